@@ -0,0 +1,244 @@
+"""
+Micro-benchmarks for the auth and user hot paths.
+
+Runs against a throwaway Postgres container, the same way tests/conftest.py does.
+
+    python -m benchmarks.bench --output baseline.json
+    python -m benchmarks.bench --compare baseline.json --threshold 0.15
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute, serialize_response
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from testcontainers.postgres import PostgresContainer
+
+from fastapi_boilerplate.app import app_test_env
+from fastapi_boilerplate.core.database import get_session
+from fastapi_boilerplate.core.security import (
+    create_access_token,
+    get_password_hash,
+    verify_password,
+    verify_token,
+)
+from fastapi_boilerplate.crud.users import user_crud
+from fastapi_boilerplate.models.base import Base
+from fastapi_boilerplate.models.users import User
+from fastapi_boilerplate.schemas.pagination import PaginatedResponse
+from fastapi_boilerplate.schemas.users import UserCreate, UserOut
+from fastapi_boilerplate.utils.pagination import create_paginated_response
+from fastapi_boilerplate.utils.responses import PydanticJSONResponse, construct_page
+
+PASSWORD = 'benchmark-password'
+SEED_USERS = 200
+MIN_ROUND_SECONDS = 0.2
+ROUNDS = 5
+
+
+async def _call(func):
+    result = func()
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _autorange(func) -> int:
+    """
+    Find an iteration count that makes one round last at least MIN_ROUND_SECONDS
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            await _call(func)
+        if time.perf_counter() - start >= MIN_ROUND_SECONDS:
+            return number
+        number *= 2
+
+
+async def measure(func) -> dict:
+    """
+    Time func over ROUNDS rounds, reporting per-call microseconds
+    """
+    number = await _autorange(func)
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(number):
+            await _call(func)
+        timings.append((time.perf_counter() - start) / number * 1e6)
+
+    return {
+        'median_us': statistics.median(timings),
+        'min_us': min(timings),
+        'max_us': max(timings),
+        'iterations': number,
+        'rounds': ROUNDS,
+    }
+
+
+def _fake_users(count: int) -> list:
+    users = []
+    for i in range(count):
+        user = User(
+            username=f'user_{i:04d}',
+            email=f'user_{i:04d}@example.com',
+            first_name='Bench',
+            last_name=f'User {i}',
+            password='hash',
+        )
+        user.id = uuid.uuid4()
+        user.created_at = datetime.now()
+        users.append(user)
+    return users
+
+
+def _route(path: str, method: str) -> APIRoute:
+    for route in app_test_env.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route
+    raise LookupError(f'{method} {path} not found')
+
+
+async def _seed(engine) -> uuid.UUID:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        await user_crud.create_admin(session, PASSWORD)
+        users = [
+            UserCreate(
+                username=f'user_{i:04d}',
+                email=f'user_{i:04d}@example.com',
+                first_name='Bench',
+                last_name=f'User {i}',
+                password=PASSWORD,
+            )
+            for i in range(SEED_USERS)
+        ]
+        await user_crud.bulk_create_users(session, users)
+        user = await user_crud.get_user_by_username(session, 'user_0000')
+        return user.id
+
+
+async def run_benchmarks(engine, selected=None) -> dict:
+    user_id = await _seed(engine)
+
+    async def get_session_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    app_test_env.dependency_overrides[get_session] = get_session_override
+
+    token = create_access_token({'sub': 'admin'})
+    password_hash = get_password_hash(PASSWORD)
+    page = create_paginated_response(_fake_users(200), total_count=SEED_USERS, skip=0, limit=200)
+    list_route = _route('/api/v1/users/', 'GET')
+    response_class = list_route.response_class
+    if isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+
+    async def serialize_page():
+        content = await serialize_response(field=list_route.response_field, response_content=page)
+        response_class(content)
+
+    def serialize_page_fast():
+        PydanticJSONResponse(construct_page(page, UserOut), PaginatedResponse[UserOut])
+
+    transport = ASGITransport(app=app_test_env)
+    async with AsyncClient(transport=transport, base_url='http://bench') as client:
+        headers = {'Authorization': f'Bearer {token}'}
+        login_form = {'username': 'admin', 'password': PASSWORD}
+
+        benchmarks = {
+            'security.verify_token': lambda: verify_token(token),
+            'security.create_access_token': lambda: create_access_token({'sub': 'admin'}),
+            'security.get_password_hash': lambda: get_password_hash(PASSWORD),
+            'security.verify_password': lambda: verify_password(PASSWORD, password_hash),
+            'serialize.paginated_users_200': serialize_page,
+            'serialize.paginated_users_200_fast': serialize_page_fast,
+            'asgi.post_auth_login': lambda: client.post('/api/v1/auth/login', data=login_form),
+            'asgi.get_auth_user': lambda: client.get('/api/v1/auth/user', headers=headers),
+            'asgi.get_users': lambda: client.get('/api/v1/users/', headers=headers),
+            'asgi.get_user_by_id': lambda: client.get(f'/api/v1/users/{user_id}', headers=headers),
+        }
+
+        results = {}
+        for name, func in benchmarks.items():
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+            results[name] = await measure(func)
+            print(f'{name:<36} {results[name]["median_us"]:>12.1f} us')
+
+    app_test_env.dependency_overrides.clear()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Return the benchmarks whose median got slower than the baseline by more than threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result['median_us'] / reference['median_us']
+        marker = 'REGRESSION' if ratio > 1 + threshold else 'ok'
+        print(f'{name:<36} {reference["median_us"]:>12.1f} -> {result["median_us"]:>12.1f} us  x{ratio:.2f}  {marker}')
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Allowed slowdown ratio (default: 0.15)')
+    parser.add_argument('-k', dest='selected', action='append', help='Only run benchmarks containing this text')
+    args = parser.parse_args(argv)
+
+    with PostgresContainer('postgres:17', driver='psycopg') as postgres:
+        engine = create_async_engine(postgres.get_connection_url())
+        results = asyncio.run(run_benchmarks(engine, args.selected))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'meta': {
+                        'created_at': datetime.now(timezone.utc).isoformat(),
+                        'python': sys.version.split()[0],
+                        'platform': platform.platform(),
+                    },
+                    'results': results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} benchmark(s) regressed past {args.threshold:.0%}: {", ".join(regressions)}')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Compression level sweep for the response payloads the API actually sends.
+
+Reports, for every encoding and level, the compression ratio and the CPU time spent per MiB, so
+COMPRESSION_GZIP_LEVEL and COMPRESSION_ZSTD_LEVEL can be chosen by CPU vs bytes saved. Needs no database.
+
+    python -m benchmarks.compression
+    python -m benchmarks.compression --levels gzip=1,6,9 --levels zstd=1,3,10
+"""
+
+import argparse
+import sys
+import time
+
+from benchmarks.bench import _fake_users
+from fastapi_boilerplate.core.compression import ENCODERS
+from fastapi_boilerplate.schemas.pagination import PaginatedResponse
+from fastapi_boilerplate.schemas.users import UserOut
+from fastapi_boilerplate.utils.export import CHUNK_SIZE
+from fastapi_boilerplate.utils.pagination import create_paginated_response
+from fastapi_boilerplate.utils.responses import PydanticJSONResponse, construct_page
+
+DEFAULT_LEVELS = {'gzip': [1, 3, 6, 9], 'zstd': [1, 3, 6, 10, 19]}
+EXPORT_USERS = 5000
+MIN_SECONDS = 0.2
+
+
+def _payloads() -> dict:
+    """
+    A full users page sent in one piece, and an NDJSON export sent in CHUNK_SIZE pieces
+    """
+    page = create_paginated_response(_fake_users(200), total_count=200, skip=0, limit=200)
+    page_body = PydanticJSONResponse(construct_page(page, UserOut), PaginatedResponse[UserOut]).body
+
+    export = b''.join(_ndjson_line(user) for user in _fake_users(EXPORT_USERS))
+    export_chunks = [export[i : i + CHUNK_SIZE] for i in range(0, len(export), CHUNK_SIZE)]
+    return {'page_200': [page_body], 'export_ndjson': export_chunks}
+
+
+def _ndjson_line(user) -> bytes:
+    return UserOut.model_validate(user).model_dump_json().encode() + b'\n'
+
+
+def _compress(encoding: str, level: int, chunks: list) -> int:
+    encoder = ENCODERS[encoding](level)
+    last = len(chunks) - 1
+    return sum(len(encoder.compress(chunk, final=i == last)) for i, chunk in enumerate(chunks))
+
+
+def measure(encoding: str, level: int, chunks: list) -> dict:
+    size = sum(len(chunk) for chunk in chunks)
+    compressed = _compress(encoding, level, chunks)
+
+    rounds = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < MIN_SECONDS:
+        _compress(encoding, level, chunks)
+        rounds += 1
+
+    per_call = elapsed / rounds
+    return {
+        'size': size,
+        'compressed': compressed,
+        'ratio': size / compressed,
+        'us': per_call * 1e6,
+        'ms_per_mib': per_call * 1e3 / (size / 2**20),
+    }
+
+
+def _parse_levels(values) -> dict:
+    if not values:
+        return DEFAULT_LEVELS
+    levels = {}
+    for value in values:
+        encoding, _, numbers = value.partition('=')
+        if encoding not in ENCODERS:
+            raise SystemExit(f'unknown encoding {encoding!r}, expected one of {", ".join(ENCODERS)}')
+        levels[encoding] = [int(number) for number in numbers.split(',')]
+    return levels
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', action='append', help='encoding=level,level,... (repeatable)')
+    args = parser.parse_args(argv)
+
+    print(f'{"payload":<14} {"encoding":<8} {"level":>5} {"bytes":>10} {"ratio":>7} {"time":>11} {"ms/MiB":>8}')
+    for payload, chunks in _payloads().items():
+        for encoding, levels in _parse_levels(args.levels).items():
+            for level in levels:
+                result = measure(encoding, level, chunks)
+                print(
+                    f'{payload:<14} {encoding:<8} {level:>5} {result["compressed"]:>10} {result["ratio"]:>7.2f}'
+                    f' {result["us"]:>8.0f} us {result["ms_per_mib"]:>8.2f}'
+                )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
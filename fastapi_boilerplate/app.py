@@ -1,30 +1,36 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from loguru import logger
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi_boilerplate.core.database import create_tables, engine
+from fastapi_boilerplate.core.database import engine
+from fastapi_boilerplate.core.keys import get_key_set
+from fastapi_boilerplate.core.middleware import CompressionMiddleware, MetricsMiddleware, QueryStatsMiddleware
+from fastapi_boilerplate.core.security import HashingUnavailable
 from fastapi_boilerplate.core.settings import settings
+from fastapi_boilerplate.core.startup import prepare_schema, run_exclusively, schema_ready
 from fastapi_boilerplate.crud.users import user_crud
-from fastapi_boilerplate.routers import auth, health, users
+from fastapi_boilerplate.routers import auth, health, jwks, metrics, users
 
 origins = settings.cors_origins
 
+# orjson encodes whatever FastAPI's jsonable_encoder leaves behind noticeably faster than the stdlib
+default_response_class = ORJSONResponse if settings.fast_json_responses else JSONResponse
 
-def create_admin_user():  # pragma: no cover
+
+async def create_admin_user():  # pragma: no cover
     """
     Create default admin user if not created
     """
     try:
-        with Session(engine) as db:
-            # Verifica se o admin já existe
-            existing_admin = user_crud.get_user_by_username(db, 'admin')
-
-            if not existing_admin:
-                user_crud.create_admin(db, settings.admin_password)
-            else:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            # The insert itself tells whether the admin already exists
+            try:
+                await user_crud.create_admin(db, settings.admin_password)
+            except ValueError:
                 pass
 
     except Exception as e:
@@ -32,11 +38,37 @@ def create_admin_user():  # pragma: no cover
         raise
 
 
+async def startup_done() -> bool:  # pragma: no cover
+    """
+    Whether the schema and the admin user are already in place
+    """
+    if not await schema_ready(engine, settings.startup_schema_mode):
+        return False
+    async with AsyncSession(engine) as db:
+        return await user_crud.get_user_by_username(db, 'admin') is not None
+
+
+async def hashing_unavailable_handler(request: Request, exc: HashingUnavailable):
+    """
+    Shed logins and user writes with 503 while password hashing is saturated
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': 'Server busy, try again later'},
+        headers={'Retry-After': '1'},
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    create_tables()
-    create_admin_user()
+    # Startup, failing fast on a misconfigured signing key
+    get_key_set()
+
+    # One worker or replica prepares the database, the others wait for it and find the work done
+    async def prepare_database():
+        await prepare_schema(engine, settings.startup_schema_mode)
+
+    await run_exclusively(engine, prepare_database, create_admin_user, is_done=startup_done)
     yield
     # Shutdown
 
@@ -46,6 +78,7 @@ app = FastAPI(
     description='My basic API',
     version='1.0.0',
     lifespan=lifespan,
+    default_response_class=default_response_class,
     swagger_ui_parameters={
         'persistAuthorization': True,
     },
@@ -55,6 +88,7 @@ app_test_env = FastAPI(
     title='FastAPI Boilerplate',
     description='My basic API',
     version='1.0.0',
+    default_response_class=default_response_class,
     swagger_ui_parameters={
         'persistAuthorization': True,
     },
@@ -72,9 +106,22 @@ def register_routers(app):
         expose_headers=['*'],
         max_age=86400,  # 24 hours
     )
+    app.add_middleware(QueryStatsMiddleware)
+    app.add_exception_handler(HashingUnavailable, hashing_unavailable_handler)
+
+    if settings.compression:
+        app.add_middleware(
+            CompressionMiddleware, encodings=settings.compression, minimum_size=settings.compression_minimum_size
+        )
+
+    # Added last so it wraps every other middleware
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(metrics.router, tags=['metrics'])
 
     app.include_router(health.router, prefix='/api/v1', tags=['health'])
     app.include_router(auth.router, prefix='/api/v1', tags=['authentication'])
+    app.include_router(jwks.router, tags=['authentication'])
     app.include_router(users.router, prefix='/api/v1', tags=['users'])
 
 
@@ -1,9 +1,15 @@
+import hmac
+import uuid
+from dataclasses import dataclass
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from fastapi_boilerplate.core.cache import principal_cache
 from fastapi_boilerplate.core.database import get_session
 from fastapi_boilerplate.core.security import verify_token
+from fastapi_boilerplate.core.settings import settings
 from fastapi_boilerplate.crud.users import user_crud
 from fastapi_boilerplate.models.users import User
 
@@ -11,7 +17,23 @@ from fastapi_boilerplate.models.users import User
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='api/v1/auth/login')
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)) -> User:
+@dataclass(frozen=True)
+class Principal:
+    """
+    Authenticated user as seen by route dependencies, detached from any session so it can be cached across requests
+    """
+
+    id: uuid.UUID
+    username: str
+    email: str
+    is_admin: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> 'Principal':
+        return cls(id=user.id, username=user.username, email=user.email, is_admin=user.is_admin)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_session)) -> Principal:
     """
     Dependency to get current authenticated user from JWT token
     """
@@ -34,20 +56,26 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             headers={'WWW-Authenticate': 'Bearer'},
         )
 
-    # Get user from database
-    user = user_crud.get_user_by_username(db=db, username=username)
+    # Get user from cache, falling back to the database. A rollback later in this session would expire the ORM
+    # instance, so only an immutable snapshot of it is cached and handed to routes
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await user_crud.get_user_by_username(db=db, username=username)
+        if user is not None:
+            principal = Principal.from_user(user)
+            principal_cache.set(username, principal)
 
-    if user is None:
+    if principal is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='User not found',
             headers={'WWW-Authenticate': 'Bearer'},
         )
 
-    return user
+    return principal
 
 
-async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_admin_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     """
     Dependency to get current authenticated admin user
     """
@@ -55,3 +83,13 @@ async def get_current_admin_user(current_user: User = Depends(get_current_user))
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Admin privileges required')
 
     return current_user
+
+
+async def require_stats_reader(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_session)) -> None:
+    """
+    Dependency guarding internal stats (metrics, pool and cache state): the metrics token or an admin user
+    """
+    if settings.metrics_token and hmac.compare_digest(token.encode(), settings.metrics_token.encode()):
+        return
+
+    await get_current_admin_user(await get_current_user(token, db))
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from loguru import logger
+
+from fastapi_boilerplate.core.settings import settings
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire after a TTL
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond maxsize
+        """
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_if(self, predicate: Callable[[Any], bool]) -> None:
+        """
+        Drop every entry whose value matches predicate
+        """
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+class RefreshingValue:
+    """
+    Single cached value that is served stale while a background task refreshes it once its TTL lapses
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value: Any = None
+        self._fetched_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value, loading it inline only when nothing has been cached yet
+        """
+        if self._fetched_at is None:
+            await self._refresh(loader)
+        elif time.monotonic() - self._fetched_at > self.ttl and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._refresh(loader))
+        return self._value
+
+    async def _refresh(self, loader: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            self._value = await loader()
+            self._fetched_at = time.monotonic()
+        except Exception as e:
+            if self._fetched_at is None:
+                raise
+            logger.error(f'Error refreshing cached value: {e}')
+
+    def clear(self) -> None:
+        self._value = None
+        self._fetched_at = None
+        self._task = None
+
+
+# Authenticated users resolved by get_current_user, keyed by token subject
+principal_cache = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl_seconds)
+
+# Verified token payloads, keyed by a digest of the token and the verification key, expiring at the token exp
+token_cache = TTLCache(maxsize=settings.token_cache_size, ttl=settings.access_token_expire_minutes * 60)
+
+# Exact users count served by the 'cached' pagination count strategy
+users_count_cache = RefreshingValue(ttl=settings.count_cache_ttl_seconds)
+
+# Whether the pg_trgm extension the user search relies on is installed, checked once per process
+search_available_cache = RefreshingValue(ttl=math.inf)
@@ -0,0 +1,66 @@
+import zlib
+from typing import Dict, Iterable, Optional
+
+import zstandard
+
+from fastapi_boilerplate.core.settings import settings
+
+
+class GzipEncoder:
+    """
+    Incremental gzip encoder, every chunk is sync-flushed so clients can decode it right away
+    """
+
+    def __init__(self, level: Optional[int] = None):
+        level = settings.compression_gzip_level if level is None else level
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class ZstdEncoder:
+    """
+    Incremental zstd encoder, every chunk is flushed as a complete block
+    """
+
+    def __init__(self, level: Optional[int] = None):
+        level = settings.compression_zstd_level if level is None else level
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._compressor.compress(data) + self._compressor.flush(mode)
+
+
+ENCODERS = {'zstd': ZstdEncoder, 'gzip': GzipEncoder}
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Iterable[str]) -> Optional[str]:
+    """
+    Pick the first of encodings (server preference order) that Accept-Encoding allows, or None
+    """
+    accepted = _parse_accept_encoding(accept_encoding)
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
@@ -1,16 +1,69 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+import time
+from typing import Optional
 
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+
+from fastapi_boilerplate.core.metrics import db_query_duration_seconds, db_statement_executions_total
+from fastapi_boilerplate.core.pool import InstrumentedAsyncQueuePool
+from fastapi_boilerplate.core.query_stats import record_query
+from fastapi_boilerplate.core.routing import ReplicaSet, RoutingSession, record_writes, session_info
 from fastapi_boilerplate.core.settings import settings
-from fastapi_boilerplate.models.base import Base
 
-engine = create_engine(settings.database_url)
 
+def create_database_engine(url: str, name: Optional[str] = None) -> AsyncEngine:
+    """
+    Engine with the pool and prepared statement settings, for the primary and each replica
+    Its pool stats are published under name, when given.
+    """
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_logging_name=name,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+        pool_recycle=settings.database_pool_recycle,
+        pool_pre_ping=settings.database_pool_pre_ping,
+        # None turns psycopg's automatic server-side prepare off
+        connect_args={
+            'prepare_threshold': settings.database_prepare_threshold if settings.database_prepared_statements else None
+        },
+    )
+
+
+engine = create_database_engine(settings.database_url, 'primary')
+replicas = ReplicaSet([
+    create_database_engine(url, f'replica-{number}') for number, url in enumerate(settings.replica_urls, 1)
+])
+
+
+def _before_cursor_execute(context, **kw):
+    context.query_start = time.perf_counter()
 
-def get_session():  # pragma: no cover
-    with Session(engine) as session:
-        yield session
 
+def _after_cursor_execute(context, statement, **kw):
+    elapsed = time.perf_counter() - context.query_start
+    db_query_duration_seconds.observe(elapsed, statement.lstrip().split(None, 1)[0].upper())
+    db_statement_executions_total.inc(context.execution_options.get('statement_name', 'other'))
+    record_query(statement, elapsed)
 
-def create_tables():
-    Base.metadata.create_all(engine)
+
+def instrument_engine(async_engine: AsyncEngine) -> None:
+    """
+    Attach the query timing listeners feeding the metrics and the per-request query stats
+    """
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', _before_cursor_execute, named=True)
+    event.listen(async_engine.sync_engine, 'after_cursor_execute', _after_cursor_execute, named=True)
+
+
+for _engine in [engine, *replicas.engines]:
+    instrument_engine(_engine)
+
+
+async def get_session(request: Request):  # pragma: no cover
+    info = await session_info(request, replicas)
+    async with AsyncSession(engine, sync_session_class=RoutingSession, expire_on_commit=False, info=info) as session:
+        yield session
+        await record_writes(session)
@@ -0,0 +1,116 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+from fastapi_boilerplate.core.settings import settings
+
+ASYMMETRIC_ALGORITHMS = {'RS256', 'EdDSA'}
+
+# JWK members hashed into the RFC 7638 thumbprint used as kid
+THUMBPRINT_MEMBERS = {'RSA': ('e', 'kty', 'n'), 'OKP': ('crv', 'kty', 'x')}
+
+
+@dataclass(frozen=True)
+class VerificationKey:
+    kid: str
+    algorithm: str
+    public_key: object
+    jwk: dict
+
+
+@dataclass(frozen=True)
+class KeySet:
+    """
+    Current signing key plus every public key whose tokens are still accepted
+    """
+
+    kid: str
+    algorithm: str
+    private_key: object
+    keys: Dict[str, VerificationKey]
+
+    @property
+    def fingerprint(self) -> str:
+        return ','.join(sorted(self.keys))
+
+    def jwks(self) -> dict:
+        return {'keys': [key.jwk for key in self.keys.values()]}
+
+
+def _public_jwk(public_key) -> Tuple[str, dict]:
+    if isinstance(public_key, RSAPublicKey):
+        return 'RS256', RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    if isinstance(public_key, Ed25519PublicKey):
+        return 'EdDSA', OKPAlgorithm.to_jwk(public_key, as_dict=True)
+    raise ValueError('JWT keys must be RSA or Ed25519')
+
+
+def _thumbprint(jwk: dict) -> str:
+    members = {name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk['kty']]}
+    digest = hashlib.sha256(json.dumps(members, separators=(',', ':'), sort_keys=True).encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def _load_pem(path: str):
+    """
+    Load a PEM private or public key, returning (private key or None, public key)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b'PRIVATE KEY' in data:
+        private_key = load_pem_private_key(data, password=None)
+        if not isinstance(private_key, (RSAPrivateKey, Ed25519PrivateKey)):
+            raise ValueError(f'{path}: JWT keys must be RSA or Ed25519')
+        return private_key, private_key.public_key()
+    return None, load_pem_public_key(data)
+
+
+def _verification_key(public_key) -> VerificationKey:
+    algorithm, jwk = _public_jwk(public_key)
+    kid = _thumbprint(jwk)
+    return VerificationKey(kid, algorithm, public_key, {**jwk, 'kid': kid, 'alg': algorithm, 'use': 'sig'})
+
+
+@lru_cache(maxsize=4)
+def load_key_set(private_key_path: str, retired_key_paths: Tuple[str, ...] = ()) -> KeySet:
+    """
+    Load the signing key and the retired keys still accepted for verification
+    Raises:
+        ValueError: If a key is not an RSA or Ed25519 PEM key
+    """
+    private_key, public_key = _load_pem(private_key_path)
+    if private_key is None:
+        raise ValueError(f'{private_key_path}: the signing key must be a private key')
+
+    current = _verification_key(public_key)
+    keys = {current.kid: current}
+    for path in retired_key_paths:
+        retired = _verification_key(_load_pem(path)[1])
+        keys.setdefault(retired.kid, retired)
+
+    return KeySet(kid=current.kid, algorithm=current.algorithm, private_key=private_key, keys=keys)
+
+
+def get_key_set() -> Optional[KeySet]:
+    """
+    Key set configured in settings, or None when tokens are signed with the shared secret
+    Raises:
+        ValueError: If an asymmetric algorithm is configured without a matching private key
+    """
+    if settings.algorithm not in ASYMMETRIC_ALGORITHMS:
+        return None
+    if not settings.jwt_private_key_path:
+        raise ValueError(f'{settings.algorithm} requires JWT_PRIVATE_KEY_PATH')
+
+    key_set = load_key_set(settings.jwt_private_key_path, tuple(settings.jwt_retired_keys))
+    if key_set.algorithm != settings.algorithm:
+        raise ValueError(f'JWT_PRIVATE_KEY_PATH holds a {key_set.algorithm} key but ALGORITHM is {settings.algorithm}')
+    return key_set
@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Default latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with cumulative (Prometheus-style) bucket counts
+    """
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = {}
+        running = 0
+        for bound, count in zip([*self.buckets, float('inf')], counts):
+            running += count
+            cumulative['+Inf' if bound == float('inf') else str(bound)] = running
+
+        return {'buckets': cumulative, 'count': running, 'sum': total}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, labelvalues: Tuple[str, ...], amount: float) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(
+            f'{self.name}{_format_labels(self.labelnames, labels)} {value}' for labels, value in values.items()
+        )
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self._add(labelvalues, amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self._add(labelvalues, amount)
+
+    def dec(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self._add(labelvalues, -amount)
+
+
+class HistogramFamily:
+    """
+    Labeled set of histograms exported under a single Prometheus metric name
+    """
+
+    type = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues: str) -> Histogram:
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        self.labels(*labelvalues).observe(value)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            children = dict(self._children)
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, histogram in children.items():
+            lines.extend(render_histogram(self.name, histogram, self.labelnames, labels))
+        return lines
+
+
+def render_histogram(
+    name: str, histogram: Histogram, labelnames: Sequence[str] = (), labelvalues: Sequence[str] = ()
+) -> List[str]:
+    snapshot = histogram.snapshot()
+    lines = [
+        f'{name}_bucket{_format_labels([*labelnames, "le"], [*labelvalues, bound])} {count}'
+        for bound, count in snapshot['buckets'].items()
+    ]
+    lines.append(f'{name}_sum{_format_labels(labelnames, labelvalues)} {snapshot["sum"]}')
+    lines.append(f'{name}_count{_format_labels(labelnames, labelvalues)} {snapshot["count"]}')
+    return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[str]]) -> None:
+        """
+        Register a callable producing exposition lines at scrape time
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests_total = registry.register(
+    Counter('http_requests_total', 'Total HTTP requests', ['method', 'route', 'status'])
+)
+http_request_duration_seconds = registry.register(
+    HistogramFamily('http_request_duration_seconds', 'HTTP request latency', ['method', 'route'])
+)
+http_requests_in_progress = registry.register(
+    Gauge('http_requests_in_progress', 'HTTP requests currently being served', ['method'])
+)
+db_query_duration_seconds = registry.register(
+    HistogramFamily('db_query_duration_seconds', 'Database statement execution time', ['operation'])
+)
+db_statement_executions_total = registry.register(
+    Counter('db_statement_executions_total', 'Executions of the named hot statements', ['statement'])
+)
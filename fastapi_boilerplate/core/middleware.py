@@ -0,0 +1,154 @@
+import time
+from typing import List
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from fastapi_boilerplate.core.compression import ENCODERS, negotiate_encoding
+from fastapi_boilerplate.core.metrics import (
+    http_request_duration_seconds,
+    http_requests_in_progress,
+    http_requests_total,
+)
+from fastapi_boilerplate.core.query_stats import track_queries
+from fastapi_boilerplate.core.settings import settings
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency, status codes and in-flight requests
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        http_requests_in_progress.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_progress.dec(method)
+
+            # Label by route template to keep cardinality bounded
+            route = scope.get('route')
+            template = route.path if route is not None else 'unmatched'
+            http_request_duration_seconds.observe(elapsed, method, template)
+            http_requests_total.inc(method, template, str(status_code))
+
+
+class QueryStatsMiddleware:
+    """
+    Pure ASGI middleware tracking the queries of each request, reported as headers in debug mode
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries(scope) as stats:
+
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start' and settings.debug:
+                    message.setdefault('headers', [])
+                    message['headers'] = [
+                        *message['headers'],
+                        (b'x-db-query-count', str(stats.count).encode()),
+                        (b'server-timing', f'db;dur={stats.duration * 1000:.2f}'.encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing response bodies with the best encoding the client accepts
+    Streaming bodies are compressed chunk by chunk as they are sent, never buffered.
+    """
+
+    excluded_content_types = ('text/event-stream',)
+
+    def __init__(self, app, encodings: List[str], minimum_size: int = 1024):
+        self.app = app
+        self.encodings = [encoding for encoding in encodings if encoding in ENCODERS]
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body' or passthrough:
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if encoder is None:
+                headers = MutableHeaders(raw=start_message.setdefault('headers', []))
+                # Small complete bodies are not worth it, a streamed body is compressed from its first chunk
+                if not self._should_compress(start_message['status'], headers) or (
+                    not more_body and len(body) < self.minimum_size
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                encoder = ENCODERS[encoding]()
+                headers['Content-Encoding'] = encoding
+                headers.add_vary_header('Accept-Encoding')
+                del headers['Content-Length']
+                # The encoded bytes differ from the tagged representation, nginx weakens the tag the same way
+                etag = headers.get('ETag')
+                if etag and not etag.startswith('W/'):
+                    headers['ETag'] = f'W/{etag}'
+                await send(start_message)
+
+            await send({
+                'type': 'http.response.body',
+                'body': encoder.compress(body, final=not more_body),
+                'more_body': more_body,
+            })
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _should_compress(self, status: int, headers: MutableHeaders) -> bool:
+        if status < 200 or status in {204, 304}:  # noqa: PLR2004
+            return False
+        if 'content-encoding' in headers:
+            return False
+        return not headers.get('content-type', '').startswith(self.excluded_content_types)
@@ -0,0 +1,130 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+from fastapi_boilerplate.core.metrics import Histogram, registry, render_histogram
+from fastapi_boilerplate.core.settings import settings
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolStats:
+    """
+    Counters of one connection pool, fed by InstrumentedAsyncQueuePool
+    """
+
+    def __init__(self, name: str, pool: Optional[Pool] = None):
+        self.name = name
+        self.pool = pool
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = Histogram(WAIT_BUCKETS)
+        self._lock = threading.Lock()
+
+    def record_checkout(self) -> None:
+        with self._lock:
+            self.checkouts += 1
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_seconds.observe(seconds)
+        if seconds >= settings.database_pool_wait_warning_seconds:
+            logger.warning(f'Waited {seconds:.3f}s for a {self.name} database connection: {self.snapshot()}')
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+        logger.error(f'Timed out waiting for a {self.name} database connection: {self.snapshot()}')
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        return {
+            'size': pool.size() if pool else 0,
+            'checked_out': pool.checkedout() if pool else 0,
+            'checked_in': pool.checkedin() if pool else 0,
+            'overflow': pool.overflow() if pool else 0,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds': self.wait_seconds.snapshot(),
+        }
+
+
+class PoolStatsRegistry:
+    """
+    Stats of the named pools (primary, replica-1...), exported as series labeled by pool
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, PoolStats] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, pool: Pool) -> PoolStats:
+        """
+        Stats of the pool named name, kept across the pool being recreated on engine disposal
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = PoolStats(name)
+            stats.pool = pool
+            return stats
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            stats = list(self._stats.values())
+        return {pool.name: pool.snapshot() for pool in stats}
+
+    def collect(self) -> list:
+        """
+        Render the pools state in the Prometheus text format
+        """
+        with self._lock:
+            stats = list(self._stats.values())
+        snapshots = [(pool.name, pool.snapshot()) for pool in stats]
+        lines = []
+        for key, metric_type in (
+            ('size', 'gauge'),
+            ('checked_out', 'gauge'),
+            ('overflow', 'gauge'),
+            ('checkouts', 'counter'),
+            ('timeouts', 'counter'),
+        ):
+            name = f'db_pool_{key}_total' if metric_type == 'counter' else f'db_pool_{key}'
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{name}{{pool="{pool}"}} {snapshot[key]}' for pool, snapshot in snapshots)
+
+        lines.append('# TYPE db_pool_wait_seconds histogram')
+        for pool in stats:
+            lines.extend(render_histogram('db_pool_wait_seconds', pool.wait_seconds, ['pool'], [pool.name]))
+        return lines
+
+
+pool_stats = PoolStatsRegistry()
+registry.register_collector(pool_stats.collect)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that times every connection checkout, including the wait for a free slot
+    Pools named through the engine's pool_logging_name report to pool_stats, the others only to their own stats.
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        name = self.logging_name
+        self.stats = pool_stats.register(name, self) if name else PoolStats('unnamed', self)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+        self.stats.record_checkout()
+        return connection
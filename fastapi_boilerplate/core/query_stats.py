@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from fastapi_boilerplate.core.settings import settings
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised in strict mode when a request issues more queries than its declared budget
+    """
+
+
+@dataclass
+class QueryStats:
+    scope: Optional[dict] = None
+    count: int = 0
+    duration: float = 0.0
+    budget: Optional[int] = None
+
+    @property
+    def route(self) -> str:
+        if self.scope is None:
+            return '-'
+        route = self.scope.get('route')
+        return f'{self.scope["method"]} {route.path if route is not None else self.scope["path"]}'
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+@contextmanager
+def track_queries(scope: Optional[dict] = None) -> Iterator[QueryStats]:
+    """
+    Count the queries issued in the current context
+    """
+    stats = QueryStats(scope=scope)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def record_query(statement: str, elapsed: float) -> None:
+    """
+    Account a finished statement to the current request and log it if slow
+    """
+    stats = _current_stats.get()
+
+    if settings.slow_query_threshold_ms and elapsed * 1000 >= settings.slow_query_threshold_ms:
+        route = stats.route if stats else '-'
+        logger.warning(f'Slow query ({elapsed * 1000:.1f} ms) on {route}: {statement}')
+
+    if stats is None:
+        return
+
+    stats.count += 1
+    stats.duration += elapsed
+
+    if stats.budget is not None and stats.count == stats.budget + 1:
+        message = f'{stats.route} exceeded its query budget of {stats.budget}'
+        if settings.query_budget_strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def query_budget(max_queries: int):
+    """
+    Route dependency declaring the maximum number of queries the request may issue
+    """
+
+    async def dependency():
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.budget = max_queries
+
+    return dependency
@@ -0,0 +1,166 @@
+import importlib
+import itertools
+import math
+from abc import ABC, abstractmethod
+from functools import partial
+from typing import List, Optional
+
+from fastapi import Request
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+from fastapi_boilerplate.core.cache import RefreshingValue, TTLCache
+from fastapi_boilerplate.core.query_stats import track_queries
+from fastapi_boilerplate.core.security import verify_token
+from fastapi_boilerplate.core.settings import settings
+
+READ_METHODS = {'GET', 'HEAD'}
+
+# Replay delay of a standby, 0 when it has replayed everything it received (or is not a standby at all)
+REPLICATION_LAG_SQL = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class RecentWritesBackend(ABC):
+    """
+    Principals that wrote recently, whose reads stay on the primary to see their own writes
+    Implement it over a shared store (Redis keys with an expiry, memcached...) so every worker routes them alike.
+    """
+
+    @abstractmethod
+    async def mark(self, principal: str, ttl: float) -> None:
+        """
+        Record a write of principal, which may be forgotten after ttl
+        """
+
+    @abstractmethod
+    async def wrote_recently(self, principal: str) -> bool:
+        """
+        Whether principal was marked within its ttl
+        """
+
+
+class MemoryRecentWritesBackend(RecentWritesBackend):
+    """
+    In-process backend, a principal's reads only follow its writes within the worker that served them
+    """
+
+    def __init__(self):
+        self._writers = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.read_your_writes_seconds)
+
+    async def mark(self, principal: str, ttl: float) -> None:
+        self._writers.set(principal, True, ttl=ttl)
+
+    async def wrote_recently(self, principal: str) -> bool:
+        return bool(self._writers.get(principal))
+
+
+def load_recent_writes_backend(path: Optional[str]) -> RecentWritesBackend:
+    """
+    Instantiate the backend factory at 'module:attribute', or the in-memory backend when path is empty
+    """
+    if not path:
+        return MemoryRecentWritesBackend()
+    module, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module), attribute)()
+
+
+recent_writes = load_recent_writes_backend(settings.read_your_writes_backend)
+
+
+class RoutingSession(Session):
+    """
+    Session sending reads to the replica chosen for it, if any, and everything else to the primary
+    The first write pins the rest of the session to the primary and flags it for record_writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+            self.info['replica'] = None
+        else:
+            replica = self.info.get('replica')
+            if replica is not None:
+                return replica.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+class ReplicaSet:
+    """
+    Read replicas, each skipped while its replication lag is over the threshold
+    """
+
+    def __init__(self, engines: List[AsyncEngine]):
+        self.engines = engines
+        # Lag is measured at most once per interval and refreshed in the background
+        self._lags = [RefreshingValue(ttl=settings.replica_lag_check_interval_seconds) for _ in engines]
+        self._turn = itertools.count()
+
+    @staticmethod
+    async def _measure_lag(engine: AsyncEngine) -> float:
+        try:
+            # Health checks are not part of the request that happens to trigger them
+            with track_queries():
+                async with engine.connect() as conn:
+                    return float(await conn.scalar(REPLICATION_LAG_SQL))
+        except Exception as e:
+            logger.warning(f'Replica {engine.url.host} unavailable: {e}')
+            return math.inf
+
+    async def lags(self) -> List[float]:
+        return [await lag.get(partial(self._measure_lag, engine)) for engine, lag in zip(self.engines, self._lags)]
+
+    async def choose(self) -> Optional[AsyncEngine]:
+        """
+        Next replica in round robin among those within the lag threshold, or None
+        """
+        if not self.engines:
+            return None
+        lags = await self.lags()
+        healthy = [engine for engine, lag in zip(self.engines, lags) if lag <= settings.replica_max_lag_seconds]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+
+def _principal(request: Request) -> Optional[str]:
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    payload = verify_token(token)
+    return payload.get('sub') if payload else None
+
+
+async def session_info(request: Request, replicas: ReplicaSet) -> dict:
+    """
+    Routing of the request session: reads of GET requests go to a replica, unless the principal just wrote
+    """
+    principal = _principal(request)
+    replica = None
+    if request.method in READ_METHODS and not (principal and await recent_writes.wrote_recently(principal)):
+        replica = await replicas.choose()
+    return {'principal': principal, 'replica': replica}
+
+
+async def record_writes(session: AsyncSession) -> None:
+    """
+    Open the read-your-writes window of the session's principal if the session wrote
+    """
+    principal = session.info.get('principal')
+    if principal and session.info.get('wrote'):
+        await recent_writes.mark(principal, settings.read_your_writes_seconds)
+
+
+def sibling_session(db: AsyncSession, primary: bool = False) -> AsyncSession:
+    """
+    New session routed like db, or to the primary, for work outliving it such as streams and background refreshes
+    """
+    info = dict(db.sync_session.info)
+    if primary:
+        info['replica'] = None
+    return AsyncSession(db.bind, sync_session_class=db.sync_session_class, expire_on_commit=False, info=info)
@@ -1,15 +1,33 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
 # from jose import JWTError
-from jwt import DecodeError, ExpiredSignatureError, InvalidTokenError, decode, encode
+from jwt import DecodeError, ExpiredSignatureError, InvalidTokenError, decode, encode, get_unverified_header
 from pwdlib import PasswordHash
 
+from fastapi_boilerplate.core.cache import token_cache
+from fastapi_boilerplate.core.keys import KeySet, get_key_set
 from fastapi_boilerplate.core.settings import settings
 
 # Password hashing context
 pwd_context = PasswordHash.recommended()
 
+# Argon2 releases the GIL, so a thread pool keeps hashing off the event loop
+_hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix='password-hash')
+_hash_pending = 0
+_hash_lock = threading.Lock()
+
+
+class HashingUnavailable(Exception):
+    """
+    Raised when the password hashing queue is full, callers should retry later
+    """
+
 
 def verify_password(plain_password: str, password: str) -> bool:
     """
@@ -25,6 +43,41 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def _run_in_hash_executor(func, *args):
+    """
+    Run a hashing function in the hashing executor
+    Raises:
+        HashingUnavailable: If password_hash_max_pending hashes are already queued
+    """
+    global _hash_pending  # noqa: PLW0603
+
+    with _hash_lock:
+        if _hash_pending >= settings.password_hash_max_pending:
+            raise HashingUnavailable('Password hashing queue is full')
+        _hash_pending += 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        with _hash_lock:
+            _hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, password: str) -> bool:
+    """
+    Verify a plain password against its hash without blocking the event loop
+    """
+    return await _run_in_hash_executor(verify_password, plain_password, password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Generate password hash without blocking the event loop
+    """
+    return await _run_in_hash_executor(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
     Create JWT access token
@@ -36,13 +89,50 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
 
     to_encode.update({'exp': expire})
-    encoded_jwt = encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
-    return encoded_jwt
+
+    key_set = get_key_set()
+    if key_set is None:
+        return encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+    return encode(to_encode, key_set.private_key, algorithm=key_set.algorithm, headers={'kid': key_set.kid})
+
+
+def _token_cache_key(token: str, key_set: Optional[KeySet]) -> bytes:
+    """
+    Digest of the token and the keys it is verified with, so a rotated secret or key never reuses old entries
+    """
+    keys = settings.secret_key if key_set is None else key_set.fingerprint
+    return hashlib.sha256(f'{settings.algorithm}\0{keys}\0{token}'.encode()).digest()
+
+
+def _decode(token: str, key_set: Optional[KeySet]) -> dict:
+    if key_set is None:
+        return decode(token, settings.secret_key, algorithms=[settings.algorithm])
+
+    # The kid picks the public key, its own algorithm is the only one accepted
+    key = key_set.keys.get(get_unverified_header(token).get('kid'))
+    if key is None:
+        raise InvalidTokenError('Unknown signing key')
+    return decode(token, key.public_key, algorithms=[key.algorithm])
 
 
 def verify_token(token: str) -> Optional[dict]:
+    key_set = get_key_set()
+    key = _token_cache_key(token, key_set)
+    payload = token_cache.get(key)
+    if payload is not None:
+        # The cache clock is monotonic, so the wall clock expiry is checked again
+        if payload['exp'] > time.time():
+            return dict(payload)
+        token_cache.invalidate(key)
+        return None
+
     try:
-        payload = decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        return payload
+        payload = _decode(token, key_set)
     except (InvalidTokenError, ExpiredSignatureError, DecodeError):
         return None
+
+    # Tokens without an expiry are verified every time
+    expires_at = payload.get('exp')
+    if isinstance(expires_at, (int, float)):
+        token_cache.set(key, payload, ttl=expires_at - time.time())
+    return dict(payload)
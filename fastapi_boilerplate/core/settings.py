@@ -1,7 +1,23 @@
-from typing import Optional
+from ipaddress import IPv4Network, IPv6Network, ip_network
+from typing import List, Literal, Optional, Union
 
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from fastapi_boilerplate.schemas.pagination import CountStrategy
+
+StartupSchemaMode = Literal['create_all', 'alembic', 'none']
+StartupLockMode = Literal['wait', 'skip']
+
+# PostgreSQL accepts at most 65535 bind parameters per statement. Each bulk inserted user binds 8: the 7 values
+# UserCRUD.bulk_create_users passes and the Python-side default of User.version
+MAX_BIND_PARAMETERS = 65535
+BULK_INSERT_PARAMETERS_PER_ROW = 8
+MAX_BULK_INSERT_BATCH_SIZE = MAX_BIND_PARAMETERS // BULK_INSERT_PARAMETERS_PER_ROW
+
+# Login failures the throttle keeps per key, a limit above it could never be reached
+MAX_LOGIN_FAILURES_PER_KEY = 64
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
@@ -12,12 +28,96 @@ class Settings(BaseSettings):
     postgres_password: Optional[str] = None
     postgres_db: Optional[str] = None
 
+    # Connection pool settings
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = -1
+    database_pool_pre_ping: bool = False
+    database_pool_wait_warning_seconds: float = 0.5
+
+    # Server-side prepared statements (psycopg prepares a query after this many executions on a connection).
+    # Behind PgBouncer, they need transaction pooling with max_prepared_statements (1.21+), otherwise disable them.
+    database_prepared_statements: bool = True
+    database_prepare_threshold: int = 5
+
+    # Read replica settings (comma-separated SQLAlchemy URLs, reads of GET requests are routed to them)
+    database_replica_urls: Optional[str] = None
+    replica_max_lag_seconds: float = 1.0
+    replica_lag_check_interval_seconds: float = 5
+    read_your_writes_seconds: float = 5
+    # Shared store of recent writers, 'module:attribute' of a RecentWritesBackend factory, in-memory when unset
+    read_your_writes_backend: Optional[str] = None
+
     # Security settings
     secret_key: str = 'your-secret-key-here-change-in-production'
     algorithm: str = 'HS256'
     access_token_expire_minutes: int = 30
     admin_password: Optional[str] = None
 
+    # Asymmetric token signing (ALGORITHM=RS256 or EdDSA), retired keys stay verifiable until their tokens expire
+    jwt_private_key_path: Optional[str] = None
+    jwt_retired_key_paths: Optional[str] = None
+    jwks_max_age_seconds: int = 300
+
+    # Password hashing settings
+    password_hash_workers: int = 4
+    password_hash_max_pending: int = 64
+
+    # Login throttling settings (failed attempts in a sliding window, then exponential backoff)
+    login_throttle_enabled: bool = True
+    login_throttle_window_seconds: int = 900
+    login_max_failures_per_username: int = Field(default=5, ge=1, le=MAX_LOGIN_FAILURES_PER_KEY)
+    login_max_failures_per_ip: int = Field(default=50, ge=1, le=MAX_LOGIN_FAILURES_PER_KEY)
+    login_backoff_base_seconds: float = 1
+    login_backoff_max_seconds: float = 900
+    login_throttle_backend: Optional[str] = None
+    # Comma-separated proxy addresses or networks whose X-Forwarded-For is trusted for the client IP
+    trusted_proxies: str = ''
+
+    # Bulk provisioning settings
+    bulk_insert_batch_size: int = Field(default=1000, ge=1, le=MAX_BULK_INSERT_BATCH_SIZE)
+    bulk_create_max_users: int = 10000
+
+    # Principal cache settings
+    principal_cache_size: int = 1024
+    principal_cache_ttl_seconds: int = 60
+
+    # Verified token cache settings (entries expire with the token)
+    token_cache_size: int = 4096
+
+    # Pagination settings
+    pagination_count_strategy: CountStrategy = CountStrategy.exact
+    # Filtered listings matching more users than this are left uncounted
+    pagination_filtered_count_limit: int = Field(default=1000, ge=1)
+    count_cache_ttl_seconds: int = 30
+
+    # Search settings
+    search_max_results: int = 50
+
+    # Serialization settings
+    fast_json_responses: bool = False
+
+    # Compression settings (encodings in order of preference, empty to disable)
+    compression_encodings: str = 'zstd,gzip'
+    compression_minimum_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_zstd_level: int = 3
+
+    # Observability settings
+    debug: bool = False
+    metrics_enabled: bool = True
+    # Bearer token of the metrics scraper, which otherwise needs an admin token like /health/pool
+    metrics_token: Optional[str] = None
+    slow_query_threshold_ms: int = 200
+    query_budget_strict: bool = False
+
+    # Startup settings (schema mode create_all, alembic or none; lock mode wait or skip)
+    startup_schema_mode: StartupSchemaMode = 'create_all'
+    startup_lock_mode: StartupLockMode = 'wait'
+    startup_lock_key: int = 4_177_801_307
+    alembic_config_path: str = 'alembic.ini'
+
     # CORS settings
     cors_origins: Optional[str] = None
 
@@ -28,6 +128,26 @@ class Settings(BaseSettings):
             f'@{self.database_host}:{self.database_port}/{self.postgres_db}'
         )
 
+    @property
+    def replica_urls(self) -> List[str]:
+        if self.database_replica_urls:
+            return [url.strip() for url in self.database_replica_urls.split(',') if url.strip()]
+        return []
+
+    @property
+    def compression(self) -> List[str]:
+        return [encoding.strip() for encoding in self.compression_encodings.split(',') if encoding.strip()]
+
+    @property
+    def jwt_retired_keys(self) -> List[str]:
+        if self.jwt_retired_key_paths:
+            return [path.strip() for path in self.jwt_retired_key_paths.split(',') if path.strip()]
+        return []
+
+    @property
+    def trusted_proxy_networks(self) -> List[Union[IPv4Network, IPv6Network]]:
+        return [ip_network(proxy.strip(), strict=False) for proxy in self.trusted_proxies.split(',') if proxy.strip()]
+
     @property
     def cors(self) -> Optional[str]:
         if self.cors_origins:
@@ -0,0 +1,98 @@
+from typing import Awaitable, Callable, Optional, get_args
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from loguru import logger
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_boilerplate.core.settings import StartupSchemaMode, settings
+from fastapi_boilerplate.models.base import Base
+
+SCHEMA_MODES = set(get_args(StartupSchemaMode))
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def _check_alembic_head(sync_conn) -> None:
+    expected = set(ScriptDirectory.from_config(Config(settings.alembic_config_path)).get_heads())
+    current = set(MigrationContext.configure(sync_conn).get_current_heads())
+    if current != expected:
+        raise SchemaOutOfDate(
+            f'Database schema is at {sorted(current) or "no revision"}, expected alembic head {sorted(expected)}; '
+            'run `alembic upgrade head` before starting the app'
+        )
+
+
+async def prepare_schema(async_engine: AsyncEngine, mode: StartupSchemaMode) -> None:
+    """
+    Create the tables, or check that migrations are at the alembic head, depending on mode
+    Raises:
+        SchemaOutOfDate: In alembic mode, when the database is not at the head revision
+    """
+    if mode not in SCHEMA_MODES:
+        raise ValueError(f'Unknown schema mode {mode!r}, expected one of {", ".join(sorted(SCHEMA_MODES))}')
+
+    async with async_engine.begin() as conn:
+        if mode == 'create_all':
+            await conn.run_sync(Base.metadata.create_all)
+        elif mode == 'alembic':
+            await conn.run_sync(_check_alembic_head)
+
+
+def _at_alembic_head(sync_conn) -> bool:
+    try:
+        _check_alembic_head(sync_conn)
+    except SchemaOutOfDate:
+        return False
+    return True
+
+
+def _has_all_tables(sync_conn) -> bool:
+    inspector = inspect(sync_conn)
+    return all(inspector.has_table(table.name) for table in Base.metadata.sorted_tables)
+
+
+async def schema_ready(async_engine: AsyncEngine, mode: StartupSchemaMode) -> bool:
+    """
+    Whether prepare_schema has nothing left to do in mode
+    """
+    if mode == 'none':
+        return True
+    async with async_engine.connect() as conn:
+        return await conn.run_sync(_has_all_tables if mode == 'create_all' else _at_alembic_head)
+
+
+async def run_exclusively(
+    async_engine: AsyncEngine, *tasks: Callable[[], Awaitable], is_done: Optional[Callable[[], Awaitable[bool]]] = None
+) -> bool:
+    """
+    Run startup tasks in exactly one process across workers and replicas, under a Postgres advisory lock
+    In 'wait' lock mode the other processes wait for the lock, then find the work done through is_done and start
+    without redoing it, which guarantees the schema is ready before serving. In 'skip' mode they start right away.
+    Returns:
+        Whether the tasks ran in this process
+    """
+    # Session-level lock on an autocommit connection, so no transaction stays open while tasks run
+    async with async_engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        params = {'key': settings.startup_lock_key}
+
+        if settings.startup_lock_mode == 'skip':
+            if not await conn.scalar(text('SELECT pg_try_advisory_lock(:key)'), params):
+                logger.info('Startup tasks are running in another process, skipping them')
+                return False
+        else:
+            await conn.execute(text('SELECT pg_advisory_lock(:key)'), params)
+
+        try:
+            if is_done is not None and await is_done():
+                logger.info('Startup tasks already done by another process, skipping them')
+                return False
+            for task in tasks:
+                await task()
+        finally:
+            await conn.execute(text('SELECT pg_advisory_unlock(:key)'), params)
+    return True
@@ -0,0 +1,169 @@
+import asyncio
+import importlib
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from ipaddress import ip_address
+from typing import List, Optional
+
+from fastapi import HTTPException, Request, status
+
+from fastapi_boilerplate.core.settings import MAX_LOGIN_FAILURES_PER_KEY, settings
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in settings.trusted_proxy_networks)
+
+
+def request_client_ip(request: Request) -> Optional[str]:
+    """
+    Address of the client, read from X-Forwarded-For when the request came through a trusted proxy.
+    Proxies append the address they received from, so the first untrusted hop from the right is the client
+    """
+    if request.client is None:
+        return None
+
+    address = request.client.host
+    if not _is_trusted_proxy(address):
+        return address
+
+    forwarded = request.headers.get('x-forwarded-for', '')
+    for hop in reversed([hop.strip() for hop in forwarded.split(',') if hop.strip()]):
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+
+class ThrottleBackend(ABC):
+    """
+    Storage of failure timestamps per key
+    Implement it over a shared store (Redis sorted sets, memcached...) so every replica enforces the same limits.
+    """
+
+    @abstractmethod
+    async def add(self, key: str, timestamp: float, window: float) -> None:
+        """
+        Record an event, which may be forgotten once older than window
+        """
+
+    @abstractmethod
+    async def recent(self, key: str, since: float) -> List[float]:
+        """
+        Timestamps of the events recorded for key at or after since, oldest first
+        """
+
+    @abstractmethod
+    async def clear(self, key: str) -> None:
+        """
+        Forget every event of key
+        """
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+    """
+    In-process backend, limits are enforced per replica
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._events: OrderedDict = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def add(self, key: str, timestamp: float, window: float) -> None:
+        async with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                events = self._events[key] = deque(maxlen=MAX_LOGIN_FAILURES_PER_KEY)
+            events.append(timestamp)
+            self._events.move_to_end(key)
+
+            # Keys of a credential stuffing run are mostly single use, drop the least recently failed ones
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    async def recent(self, key: str, since: float) -> List[float]:
+        async with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                return []
+            while events and events[0] < since:
+                events.popleft()
+            if not events:
+                del self._events[key]
+            return list(events)
+
+    async def clear(self, key: str) -> None:
+        async with self._lock:
+            self._events.pop(key, None)
+
+
+def load_backend(path: Optional[str]) -> ThrottleBackend:
+    """
+    Instantiate the backend factory at 'module:attribute', or the in-memory backend when path is empty
+    """
+    if not path:
+        return MemoryThrottleBackend()
+    module, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module), attribute)()
+
+
+class LoginThrottle:
+    """
+    Sliding-window limit of failed logins per username and per client IP, with exponential backoff past the limit
+    """
+
+    def __init__(self, backend: ThrottleBackend):
+        self.backend = backend
+
+    @staticmethod
+    def _keys(username: str, client_ip: Optional[str]) -> List[tuple]:
+        keys = [(f'login:user:{username.lower()}', settings.login_max_failures_per_username)]
+        if client_ip:
+            keys.append((f'login:ip:{client_ip}', settings.login_max_failures_per_ip))
+        return keys
+
+    async def check(self, username: str, client_ip: Optional[str]) -> None:
+        """
+        Reject the attempt with 429 while the username or the IP is backing off
+        """
+        if not settings.login_throttle_enabled:
+            return
+
+        now = time.time()
+        retry_after = 0.0
+        for key, limit in self._keys(username, client_ip):
+            failures = await self.backend.recent(key, now - settings.login_throttle_window_seconds)
+            if len(failures) < limit:
+                continue
+            backoff = settings.login_backoff_base_seconds * 2 ** (len(failures) - limit)
+            backoff = min(backoff, settings.login_backoff_max_seconds)
+            retry_after = max(retry_after, failures[-1] + backoff - now)
+
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many failed login attempts, try again later',
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+
+    async def record_failure(self, username: str, client_ip: Optional[str]) -> None:
+        if not settings.login_throttle_enabled:
+            return
+        now = time.time()
+        for key, _ in self._keys(username, client_ip):
+            await self.backend.add(key, now, settings.login_throttle_window_seconds)
+
+    async def record_success(self, username: str) -> None:
+        """
+        Forget the failures of the username, the IP keeps its own since it may be shared with an attacker
+        """
+        await self.backend.clear(self._keys(username, None)[0][0])
+
+
+login_throttle = LoginThrottle(load_backend(settings.login_throttle_backend))
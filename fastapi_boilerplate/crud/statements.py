@@ -0,0 +1,65 @@
+"""
+Hot user statements, built once at import instead of on every call.
+
+Each one carries a statement_name execution option, which labels db_statement_executions_total. Their SQL text
+never changes, so psycopg prepares them server side once they reach the connection's prepare threshold.
+"""
+
+from sqlalchemy import Numeric, and_, bindparam, cast, func, literal_column, or_, select, text
+
+from fastapi_boilerplate.models.users import SEARCH_DOCUMENT, User
+
+
+def _named(statement, name: str):
+    return statement.execution_options(statement_name=name)
+
+
+user_by_id = _named(select(User).where(User.id == bindparam('user_id')).limit(1), 'user_by_id')
+
+user_by_username = _named(select(User).where(User.username == bindparam('username')).limit(1), 'user_by_username')
+
+user_by_email = _named(select(User).where(User.email == bindparam('email')).limit(1), 'user_by_email')
+
+users_page = _named(
+    select(User).order_by(User.username).offset(bindparam('skip')).limit(bindparam('limit')), 'users_page'
+)
+
+users_after = _named(
+    select(User).where(User.username > bindparam('username')).order_by(User.username).limit(bindparam('limit')),
+    'users_after',
+)
+
+users_before = _named(
+    select(User).where(User.username < bindparam('username')).order_by(User.username.desc()).limit(bindparam('limit')),
+    'users_before',
+)
+
+users_count = _named(select(func.count()).select_from(User), 'users_count')
+
+users_count_estimate = _named(
+    text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)'), 'users_count_estimate'
+)
+
+pg_trgm_installed = _named(
+    text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"), 'pg_trgm_installed'
+)
+
+# Trigram search: substring or fuzzy word match, ranked by word similarity rounded so cursors compare exactly
+_search_document = literal_column(f'({SEARCH_DOCUMENT})')
+_search_rank = func.round(cast(func.word_similarity(bindparam('q'), _search_document), Numeric), 6)
+_search_match = or_(_search_document.ilike(bindparam('pattern')), bindparam('q').op('<%')(_search_document))
+
+users_search = _named(
+    select(User, _search_rank.label('rank'))
+    .where(_search_match)
+    .order_by(_search_rank.desc(), User.id)
+    .limit(bindparam('limit')),
+    'users_search',
+)
+
+users_search_after = _named(
+    users_search.where(
+        or_(_search_rank < bindparam('rank'), and_(_search_rank == bindparam('rank'), User.id > bindparam('last_id')))
+    ),
+    'users_search_after',
+)
@@ -1,47 +1,138 @@
+import asyncio
 import uuid
-from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, List, Optional, Tuple
 
-from sqlalchemy import func, select
+from sqlalchemy import delete, func, literal_column, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi_boilerplate.core.security import get_password_hash, verify_password
-from fastapi_boilerplate.models.users import User
-from fastapi_boilerplate.schemas.users import UserCreate, UserUpdate
+from fastapi_boilerplate.core.cache import principal_cache, search_available_cache, users_count_cache
+from fastapi_boilerplate.core.routing import sibling_session
+from fastapi_boilerplate.core.security import get_password_hash_async, verify_password_async
+from fastapi_boilerplate.core.settings import MAX_BULK_INSERT_BATCH_SIZE, settings
+from fastapi_boilerplate.crud import statements
+from fastapi_boilerplate.models.users import EMAIL_DOMAIN, User
+from fastapi_boilerplate.schemas.pagination import SortOrder
+from fastapi_boilerplate.schemas.users import (
+    UserBulkConflict,
+    UserBulkResult,
+    UserCreate,
+    UserFilterPage,
+    UserSortKey,
+    UserUpdate,
+)
+
+# Unique indexes on users and the conflict each one reports
+CONFLICT_DETAILS = {
+    'ix_users_username': 'username already exists',
+    'ix_users_email': 'email already exists',
+}
+
+
+# Filtered and sorted listings the users table has an index for: (equality filters, sort key) -> index.
+# A created_at range is only served when sorting by created_at, where it bounds the same index scan.
+LISTING_INDEXES = {
+    (frozenset(), UserSortKey.username): 'ix_users_username',
+    (frozenset(), UserSortKey.email): 'ix_users_email',
+    (frozenset(), UserSortKey.created_at): 'ix_users_created_at_id',
+    (frozenset({'is_admin'}), UserSortKey.username): 'ix_users_is_admin_username',
+    (frozenset({'is_admin'}), UserSortKey.created_at): 'ix_users_is_admin_created_at_id',
+    (frozenset({'email_domain'}), UserSortKey.username): 'ix_users_email_domain_username',
+    (frozenset({'email_domain'}), UserSortKey.created_at): 'ix_users_email_domain_created_at_id',
+}
+
+_email_domain = literal_column(EMAIL_DOMAIN)
+
+
+def _listing_conditions(listing: UserFilterPage) -> list:
+    conditions = []
+    if listing.is_admin is not None:
+        conditions.append(User.is_admin == listing.is_admin)
+    if listing.email_domain is not None:
+        conditions.append(_email_domain == listing.email_domain)
+    if listing.created_after is not None:
+        conditions.append(User.created_at >= listing.created_after)
+    if listing.created_before is not None:
+        conditions.append(User.created_at < listing.created_before)
+    return conditions
+
+
+def _sort_columns(sort: UserSortKey) -> list:
+    # created_at is not unique, id makes the order total so keyset pages never skip or repeat rows
+    if sort == UserSortKey.created_at:
+        return [User.created_at, User.id]
+    return [getattr(User, sort.value)]
+
+
+def listing_cursor_key(user: User, sort: UserSortKey) -> str:
+    """
+    Keyset value of a user in a listing sorted by sort, as carried by its cursors
+    """
+    if sort == UserSortKey.created_at:
+        return f'{user.created_at.isoformat()}|{user.id}'
+    return getattr(user, sort.value)
+
+
+def _parse_cursor_key(key: str, sort: UserSortKey) -> list:
+    if sort == UserSortKey.created_at:
+        created_at, user_id = key.split('|')
+        return [datetime.fromisoformat(created_at), uuid.UUID(user_id)]
+    return [key]
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
 
 
 class UserCRUD:
     @classmethod
-    def create_admin(cls, db: Session, admin_password) -> User:
+    async def _insert_user(cls, db: AsyncSession, **values) -> User:
+        """
+        Insert a user with a single INSERT ... RETURNING, naming the violated unique index on conflict
+        """
+        try:
+            db_user = await db.scalar(insert(User).values(**values).returning(User))
+            await db.commit()
+            return db_user
+        except IntegrityError as e:
+            await db.rollback()
+            constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None)
+            raise ValueError(CONFLICT_DETAILS.get(constraint, 'username or email already exists'))
+
+    @classmethod
+    async def create_admin(cls, db: AsyncSession, admin_password) -> User:
         """
         Create default admin user
         """
-        password = get_password_hash(admin_password)
-        db_user = User(
-            username='admin',
-            email='admin@admin.com',
-            first_name='Admin',
-            last_name='User',
-            password=password,
-            is_admin=True,
-        )
+        password = await get_password_hash_async(admin_password)
 
         try:
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-            return db_user
-        except IntegrityError:
-            db.rollback()
+            return await cls._insert_user(
+                db,
+                username='admin',
+                email='admin@admin.com',
+                first_name='Admin',
+                last_name='User',
+                password=password,
+                is_admin=True,
+            )
+        except ValueError:
             raise ValueError('Admin account already exists')
 
     @classmethod
-    def create_user(cls, db: Session, user_create: UserCreate) -> User:
+    async def create_user(cls, db: AsyncSession, user_create: UserCreate) -> User:
         """
         Create a new user
+        Raises:
+            ValueError: With the conflicting field if the username or email is taken
         """
-        password = get_password_hash(user_create.password)
-        db_user = User(
+        password = await get_password_hash_async(user_create.password)
+
+        return await cls._insert_user(
+            db,
             username=user_create.username,
             email=user_create.email,
             first_name=user_create.first_name,
@@ -50,111 +141,327 @@ class UserCRUD:
             is_admin=user_create.is_admin,
         )
 
-        try:
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-            return db_user
-        except IntegrityError:
-            db.rollback()
-            raise ValueError('Username or email already exists')
+    @classmethod
+    async def bulk_create_users(
+        cls, db: AsyncSession, users_create: List[UserCreate], batch_size: Optional[int] = None
+    ) -> UserBulkResult:
+        """
+        Create many users with multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING, one transaction per batch.
+        Rows that hit a unique constraint are reported as conflicts instead of aborting the batch
+        """
+        batch_size = min(batch_size or settings.bulk_insert_batch_size, MAX_BULK_INSERT_BATCH_SIZE)
+
+        # Keep the shared hashing queue available for interactive requests
+        hash_slots = asyncio.Semaphore(settings.password_hash_workers)
+
+        async def hash_password(password: str) -> str:
+            async with hash_slots:
+                return await get_password_hash_async(password)
+
+        created = 0
+        conflicts = []
+        for start in range(0, len(users_create), batch_size):
+            batch = users_create[start : start + batch_size]
+            passwords = await asyncio.gather(*(hash_password(user.password) for user in batch))
+            rows = [
+                {
+                    'id': uuid.uuid4(),
+                    'username': user.username,
+                    'email': user.email,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name,
+                    'password': password,
+                    'is_admin': user.is_admin,
+                }
+                for user, password in zip(batch, passwords)
+            ]
+
+            inserted = await db.scalars(insert(User).values(rows).on_conflict_do_nothing().returning(User.id))
+            inserted_ids = set(inserted.all())
+            await db.commit()
+            created += len(inserted_ids)
+
+            skipped = [
+                (start + offset, user)
+                for offset, (user, row) in enumerate(zip(batch, rows))
+                if row['id'] not in inserted_ids
+            ]
+            if skipped:
+                conflicts.extend(await cls._describe_conflicts(db, skipped))
+
+        return UserBulkResult(created=created, conflicts=conflicts)
+
+    @classmethod
+    async def _describe_conflicts(cls, db: AsyncSession, skipped: List[tuple]) -> List[UserBulkConflict]:
+        """
+        Tell which unique column made each skipped row conflict
+        """
+        usernames = [user.username for _, user in skipped]
+        emails = [user.email for _, user in skipped]
+        existing = await db.execute(
+            select(User.username, User.email).where(or_(User.username.in_(usernames), User.email.in_(emails)))
+        )
+        existing_usernames, existing_emails = set(), set()
+        for username, email in existing:
+            existing_usernames.add(username)
+            existing_emails.add(email)
+
+        conflicts = []
+        for index, user in skipped:
+            if user.username in existing_usernames:
+                detail = 'username already exists'
+            elif user.email in existing_emails:
+                detail = 'email already exists'
+            else:
+                detail = 'username or email already exists'
+            conflicts.append(UserBulkConflict(index=index, username=user.username, email=user.email, detail=detail))
+
+        return conflicts
 
     @classmethod
-    def get_user_by_id(cls, db: Session, user_id: uuid.UUID) -> Optional[User]:
+    async def get_user_by_id(cls, db: AsyncSession, user_id: uuid.UUID) -> Optional[User]:
         """
         Get user by ID
         """
-        return db.scalar(select(User).where(User.id == user_id).limit(1))
+        return await db.scalar(statements.user_by_id, {'user_id': user_id})
 
     @classmethod
-    def get_user_by_username(cls, db: Session, username: str) -> Optional[User]:
+    async def get_user_by_username(cls, db: AsyncSession, username: str) -> Optional[User]:
         """
         Get user by username
         """
-        return db.scalar(select(User).where(User.username == username).limit(1))
+        return await db.scalar(statements.user_by_username, {'username': username})
 
     @classmethod
-    def get_user_by_email(cls, db: Session, email: str) -> Optional[User]:
+    async def get_user_by_email(cls, db: AsyncSession, email: str) -> Optional[User]:
         """
         Get user by email
         """
-        return db.scalar(select(User).where(User.email == email).limit(1))
+        return await db.scalar(statements.user_by_email, {'email': email})
 
     @classmethod
-    def get_users(cls, db: Session, skip: int = 0, limit: int = 100) -> List[User]:
+    async def get_users(
+        cls, db: AsyncSession, skip: int = 0, limit: int = 100, listing: Optional[UserFilterPage] = None
+    ) -> List[User]:
         """
-        Get list of users with pagination, ordered by username
+        Get list of users with pagination, ordered by username unless the listing filters or sorts otherwise
+        Raises:
+            ValueError: If no index serves the listing
         """
-        return db.scalars(select(User).order_by(User.username).offset(skip).limit(limit))
+        if listing is None or listing.is_default:
+            result = await db.scalars(statements.users_page, {'skip': skip, 'limit': limit})
+            return result.all()
+
+        cls.listing_index(listing)
+        columns = _sort_columns(listing.sort)
+        if listing.order == SortOrder.desc:
+            columns = [column.desc() for column in columns]
+
+        query = select(User).where(*_listing_conditions(listing)).order_by(*columns).offset(skip).limit(limit)
+        result = await db.scalars(query)
+        return result.all()
 
     @classmethod
-    def get_users_count(cls, db: Session) -> int:
+    async def get_users_by_cursor(
+        cls,
+        db: AsyncSession,
+        key: str,
+        direction: str = 'next',
+        limit: int = 100,
+        listing: Optional[UserFilterPage] = None,
+    ) -> List[User]:
+        """
+        Get list of users after (or before, for 'prev') the given keyset value, seeking on the listing's index.
+        Rows come back in seek order: listing order for 'next', reversed for 'prev'
+        Raises:
+            ValueError: If no index serves the listing or the key does not match its sort
+        """
+        if listing is None or listing.is_default:
+            query = statements.users_before if direction == 'prev' else statements.users_after
+            result = await db.scalars(query, {'username': key, 'limit': limit})
+            return result.all()
+
+        cls.listing_index(listing)
+        columns = _sort_columns(listing.sort)
+        seek = tuple_(*columns)
+        values = tuple_(*_parse_cursor_key(key, listing.sort))
+
+        # Seek forward through the index when the page runs the same way as the sort
+        if (direction == 'prev') == (listing.order == SortOrder.desc):
+            condition, order = seek > values, columns
+        else:
+            condition, order = seek < values, [column.desc() for column in columns]
+
+        query = select(User).where(*_listing_conditions(listing), condition).order_by(*order).limit(limit)
+        result = await db.scalars(query)
+        return result.all()
+
+    @classmethod
+    def listing_index(cls, listing: UserFilterPage) -> str:
+        """
+        Name the index serving a listing's filters and sort
+        Raises:
+            ValueError: If no index serves the combination, which would scan the whole table
+        """
+        index = LISTING_INDEXES.get((listing.equality_filters, listing.sort))
+        ranged = listing.created_after is not None or listing.created_before is not None
+        if index is None or (ranged and listing.sort != UserSortKey.created_at):
+            filters = sorted(listing.equality_filters | ({'created_at'} if ranged else set()))
+            raise ValueError(f'filtering by {", ".join(filters)} and sorting by {listing.sort.value} is not supported')
+        return index
+
+    @classmethod
+    async def stream_users(cls, db: AsyncSession, batch_size: int = 1000) -> AsyncIterator[User]:
+        """
+        Stream all users ordered by username through a server-side cursor.
+        Runs on its own session, routed like the request one, so the stream can outlive it
+        """
+        async with sibling_session(db) as session:
+            result = await session.stream_scalars(
+                select(User).order_by(User.username).execution_options(yield_per=batch_size)
+            )
+            async for user in result:
+                yield user
+
+    @classmethod
+    async def search_available(cls, db: AsyncSession) -> bool:
+        """
+        Whether the pg_trgm extension search_users relies on is installed, checked once per process
+        """
+
+        async def load() -> bool:
+            return bool(await db.scalar(statements.pg_trgm_installed))
+
+        return await search_available_cache.get(load)
+
+    @classmethod
+    async def search_users(
+        cls, db: AsyncSession, query: str, limit: int = 20, after: Optional[Tuple[Decimal, uuid.UUID]] = None
+    ) -> List[Tuple[User, Decimal]]:
+        """
+        Search users by substring or fuzzy match on username, email and names, best matches first.
+        Returns (user, rank) pairs; pass the last pair's rank and id as after to continue
+        """
+        params = {'q': query, 'pattern': f'%{_escape_like(query)}%', 'limit': limit}
+        statement = statements.users_search
+        if after is not None:
+            statement = statements.users_search_after
+            params['rank'], params['last_id'] = after
+
+        result = await db.execute(statement, params)
+        return [(user, rank) for user, rank in result]
+
+    @classmethod
+    async def get_users_count(cls, db: AsyncSession) -> int:
         """
         Get total count of Users
         """
-        return db.scalar(select(func.count()).select_from(User))
+        return await db.scalar(statements.users_count)
+
+    @classmethod
+    async def get_users_count_bounded(cls, db: AsyncSession, listing: UserFilterPage, bound: int) -> int:
+        """
+        Count the Users matching the listing filters, reading at most bound of them off the listing's index
+        """
+        matching = (
+            select(*_sort_columns(listing.sort))
+            .where(*_listing_conditions(listing))
+            .order_by(*_sort_columns(listing.sort))
+            .limit(bound)
+        )
+        return await db.scalar(select(func.count()).select_from(matching.subquery()))
 
     @classmethod
-    def update_user(cls, db: Session, user_id: uuid.UUID, user_update: UserUpdate) -> Optional[User]:
+    async def get_users_count_estimate(cls, db: AsyncSession) -> Optional[int]:
         """
-        Update user information
+        Get the planner's row estimate for Users, or None if the table was never analyzed
         """
-        db_user = cls.get_user_by_id(db, user_id)
-        if not db_user:
+        estimate = await db.scalar(statements.users_count_estimate, {'table': User.__tablename__})
+        if estimate is None or estimate < 0:
             return None
+        return estimate
 
-        # Protect admin user from losing admin privileges
-        if db_user.username == 'admin' and hasattr(user_update, 'is_admin') and user_update.is_admin is False:
-            raise ValueError('Cannot remove admin privileges from the default admin user')
+    @classmethod
+    async def get_users_count_cached(cls, db: AsyncSession) -> int:
+        """
+        Get total count of Users from a TTL'd cache, refreshed in the background on its own session.
+        The refresh reads the primary: a lagging replica's count would otherwise be served for the whole TTL
+        """
 
-        update_data = user_update.dict(exclude_unset=True)
+        async def load() -> int:
+            async with sibling_session(db, primary=True) as session:
+                return await cls.get_users_count(session)
+
+        return await users_count_cache.get(load)
 
-        # Protect admin user from losing admin privileges (additional check for dict access)
-        if db_user.username == 'admin' and 'is_admin' in update_data and update_data['is_admin'] is False:
-            raise ValueError('Cannot remove admin privileges from the default admin user')
+    @classmethod
+    async def update_user(cls, db: AsyncSession, user_id: uuid.UUID, user_update: UserUpdate) -> Optional[User]:
+        """
+        Update user information with a single UPDATE ... RETURNING
+        """
+        update_data = user_update.dict(exclude_unset=True)
 
         # Hash password if provided
         if 'password' in update_data:
-            update_data['password'] = get_password_hash(update_data.pop('password'))
+            update_data['password'] = await get_password_hash_async(update_data.pop('password'))
+
+        if not update_data:
+            return await cls.get_user_by_id(db, user_id)
+
+        query = update(User).where(User.id == user_id).values(**update_data, version=User.version + 1).returning(User)
+
+        # Protect admin user from losing admin privileges
+        revokes_admin = update_data.get('is_admin') is False
+        if revokes_admin:
+            query = query.where(User.username != 'admin')
 
         try:
-            for field, value in update_data.items():
-                setattr(db_user, field, value)
+            db_user = await db.scalar(query)
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None)
+            raise ValueError(CONFLICT_DETAILS.get(constraint, 'username or email already exists'))
 
-            db.commit()
-            db.refresh(db_user)
-            return db_user
-        except IntegrityError:
-            db.rollback()
-            raise ValueError('Username or email already exists')
+        if db_user is None:
+            # Only look the row up again to tell the admin protection apart from a missing user
+            if revokes_admin and await cls.get_user_by_id(db, user_id):
+                raise ValueError('Cannot remove admin privileges from the default admin user')
+            return None
+
+        # Drop cached principals, under any previous username, so changes apply on the next request
+        principal_cache.invalidate_if(lambda user: user.id == user_id)
+        return db_user
 
     @classmethod
-    def delete_user(cls, db: Session, user_id: uuid.UUID) -> bool:
+    async def delete_user(cls, db: AsyncSession, user_id: uuid.UUID) -> bool:
         """
-        Delete user by ID
+        Delete user by ID with a single DELETE ... RETURNING
         """
-        db_user = cls.get_user_by_id(db, user_id)
-        if not db_user:
-            return False
-
         # Protect admin user from being deleted
-        if db_user.username == 'admin':
-            raise ValueError('Cannot delete the default admin user')
+        username = await db.scalar(
+            delete(User).where(User.id == user_id, User.username != 'admin').returning(User.username)
+        )
+        await db.commit()
+
+        if username is None:
+            if await cls.get_user_by_id(db, user_id):
+                raise ValueError('Cannot delete the default admin user')
+            return False
 
-        db.delete(db_user)
-        db.commit()
+        principal_cache.invalidate(username)
         return True
 
     @classmethod
-    def authenticate_user(cls, db: Session, username: str, password: str) -> Optional[User]:
+    async def authenticate_user(cls, db: AsyncSession, username: str, password: str) -> Optional[User]:
         """
         Authenticate user with username and password
         """
-        user = cls.get_user_by_username(db, username)
+        user = await cls.get_user_by_username(db, username)
 
         if not user:
             return None
-        if not verify_password(password, user.password):
+        if not await verify_password_async(password, user.password):
             return None
         return user
 
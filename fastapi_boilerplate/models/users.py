@@ -1,18 +1,62 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Boolean, String, func
+from loguru import logger
+from psycopg.errors import InsufficientPrivilege
+from sqlalchemy import Boolean, Index, Integer, String, event, func, text
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base
 
+# Text matched by the user search, spelled the same in the index and the queries so the planner can use the index
+SEARCH_DOCUMENT = "username || ' ' || email || ' ' || first_name || ' ' || last_name"
+
+# Domain part of the email, filtered through expression indexes spelled the same way
+EMAIL_DOMAIN = "split_part(email, '@', 2)"
+
+
+def _trgm_installed(ddl, target, bind, **kw) -> bool:
+    """
+    Create the search index only where the pg_trgm extension got installed
+    """
+    if bind is None:
+        return True
+    return bool(bind.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")))
+
+
+def _create_trgm_extension(target, connection, **kw) -> None:
+    """
+    Install pg_trgm where it is available and the role is allowed to, user search answers 503 without it
+    """
+    if not connection.scalar(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")):
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    except ProgrammingError as e:
+        if not isinstance(e.orig, InsufficientPrivilege):
+            raise
+        logger.warning('Not allowed to create the pg_trgm extension, user search is unavailable until it is installed')
+
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_search_trgm', text(f'({SEARCH_DOCUMENT}) gin_trgm_ops'), postgresql_using='gin').ddl_if(
+            callable_=_trgm_installed
+        ),
+        # Listing filters and sorts, see UserCRUD.listing_index; created_at ties are broken by id
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+        Index('ix_users_is_admin_username', 'is_admin', 'username'),
+        Index('ix_users_is_admin_created_at_id', 'is_admin', 'created_at', 'id'),
+        Index('ix_users_email_domain_username', text(EMAIL_DOMAIN), 'username'),
+        Index('ix_users_email_domain_created_at_id', text(EMAIL_DOMAIN), 'created_at', 'id'),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), init=False, primary_key=True, nullable=False, default=uuid.uuid4, index=True
+        UUID(as_uuid=True), init=False, primary_key=True, nullable=False, default=uuid.uuid4
     )
     username: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
     email: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
@@ -21,3 +65,8 @@ class User(Base):
     password: Mapped[str] = mapped_column(String, nullable=False)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     created_at: Mapped[datetime] = mapped_column(init=False, server_default=func.now())
+    # Bumped by every update, backs the ETag of the user representation
+    version: Mapped[int] = mapped_column(Integer, init=False, default=1, server_default=text('1'), nullable=False)
+
+
+event.listen(User.__table__, 'before_create', _create_trgm_extension)
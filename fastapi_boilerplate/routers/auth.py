@@ -1,41 +1,49 @@
 from datetime import timedelta
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi_boilerplate.core.auth import get_current_admin_user, get_current_user
+from fastapi_boilerplate.core.auth import Principal, get_current_admin_user, get_current_user
 from fastapi_boilerplate.core.database import get_session
+from fastapi_boilerplate.core.query_stats import query_budget
 from fastapi_boilerplate.core.security import create_access_token
 from fastapi_boilerplate.core.settings import settings
+from fastapi_boilerplate.core.throttle import login_throttle, request_client_ip
 from fastapi_boilerplate.crud.users import user_crud
-from fastapi_boilerplate.models.users import User
 from fastapi_boilerplate.schemas.auth import TokenResponse
 
 router = APIRouter()
 
-Session = Annotated[Session, Depends(get_session)]
-CurrentUser = Annotated[User, Depends(get_current_user)]
-CurrentAdminUser = Annotated[User, Depends(get_current_admin_user)]
+Session = Annotated[AsyncSession, Depends(get_session)]
+CurrentUser = Annotated[Principal, Depends(get_current_user)]
+CurrentAdminUser = Annotated[Principal, Depends(get_current_admin_user)]
 OAuth2Form = Annotated[OAuth2PasswordRequestForm, Depends()]
 
 
-@router.post('/auth/login', response_model=TokenResponse)
-async def login(db: Session, login_data: OAuth2Form):
+@router.post('/auth/login', response_model=TokenResponse, dependencies=[Depends(query_budget(1))])
+async def login(request: Request, db: Session, login_data: OAuth2Form):
     """
     Authenticate user and return JWT token
     """
+    # Throttled attempts are rejected before any database lookup or password hashing
+    client_ip = request_client_ip(request)
+    await login_throttle.check(login_data.username, client_ip)
+
     # Authenticate user
-    user = user_crud.authenticate_user(db=db, username=login_data.username, password=login_data.password)
+    user = await user_crud.authenticate_user(db=db, username=login_data.username, password=login_data.password)
 
     if not user:
+        await login_throttle.record_failure(login_data.username, client_ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Invalid username or password',
             headers={'WWW-Authenticate': 'Bearer'},
         )
 
+    await login_throttle.record_success(login_data.username)
+
     # Create access token
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
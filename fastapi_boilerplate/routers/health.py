@@ -1,4 +1,8 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+
+from fastapi_boilerplate.core.auth import require_stats_reader
+from fastapi_boilerplate.core.cache import principal_cache, token_cache
+from fastapi_boilerplate.core.pool import pool_stats
 
 router = APIRouter()
 
@@ -11,3 +15,14 @@ async def root():
 @router.get('/health')
 async def health_check():
     return {'status': 'healthy'}
+
+
+# Internal stats, only for admins and the metrics scraper
+@router.get('/health/cache', dependencies=[Depends(require_stats_reader)])
+async def cache_stats():
+    return {'principal_cache': principal_cache.stats(), 'token_cache': token_cache.stats()}
+
+
+@router.get('/health/pool', dependencies=[Depends(require_stats_reader)])
+async def pool_status():
+    return {'pools': pool_stats.snapshot()}
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from fastapi_boilerplate.core.keys import get_key_set
+from fastapi_boilerplate.core.settings import settings
+
+router = APIRouter()
+
+
+@router.get('/.well-known/jwks.json')
+async def jwks():
+    """
+    Public keys verifying the access tokens, including retired keys whose tokens may still be valid
+    """
+    key_set = get_key_set()
+    return JSONResponse(
+        key_set.jwks() if key_set else {'keys': []},
+        headers={'Cache-Control': f'public, max-age={settings.jwks_max_age_seconds}'},
+    )
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from fastapi_boilerplate.core.auth import require_stats_reader
+from fastapi_boilerplate.core.metrics import registry
+
+router = APIRouter()
+
+
+# Pool saturation and traffic are internal stats, guarded like /health/pool
+@router.get('/metrics', response_class=PlainTextResponse, dependencies=[Depends(require_stats_reader)])
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
@@ -1,74 +1,239 @@
-from typing import Annotated
+from decimal import Decimal
+from typing import Annotated, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi_boilerplate.core.auth import get_current_admin_user, get_current_user
+from fastapi_boilerplate.core.auth import Principal, get_current_admin_user, get_current_user
 from fastapi_boilerplate.core.database import get_session
-from fastapi_boilerplate.crud.users import user_crud
+from fastapi_boilerplate.core.query_stats import query_budget
+from fastapi_boilerplate.core.settings import settings
+from fastapi_boilerplate.crud.users import listing_cursor_key, user_crud
 from fastapi_boilerplate.models.users import User
-from fastapi_boilerplate.schemas.pagination import FilterPage, PaginatedResponse
-from fastapi_boilerplate.schemas.users import UserCreate, UserOut, UserUpdate
-from fastapi_boilerplate.utils.pagination import create_paginated_response
+from fastapi_boilerplate.schemas.export import ExportFormat
+from fastapi_boilerplate.schemas.pagination import CountStrategy, PaginatedResponse
+from fastapi_boilerplate.schemas.users import UserBulkResult, UserCreate, UserFilterPage, UserOut, UserUpdate
+from fastapi_boilerplate.utils.etag import etag_matches, not_modified, page_etag, user_etag
+from fastapi_boilerplate.utils.export import MEDIA_TYPES, stream_export
+from fastapi_boilerplate.utils.pagination import (
+    TotalCount,
+    create_keyset_paginated_response,
+    create_paginated_response,
+    decode_cursor,
+    encode_cursor,
+)
+from fastapi_boilerplate.utils.responses import PydanticJSONResponse, construct_page
 
 router = APIRouter(prefix='/users', tags=['users'])
 
-Session = Annotated[Session, Depends(get_session)]
-CurrentUser = Annotated[User, Depends(get_current_user)]
-CurrentAdminUser = Annotated[User, Depends(get_current_admin_user)]
+Session = Annotated[AsyncSession, Depends(get_session)]
+CurrentUser = Annotated[Principal, Depends(get_current_user)]
+CurrentAdminUser = Annotated[Principal, Depends(get_current_admin_user)]
 
 
-@router.get('/', response_model=PaginatedResponse[UserOut])
+async def _count_users(db: AsyncSession, strategy: CountStrategy, listing: UserFilterPage) -> TotalCount:
+    """
+    Count users with the given strategy
+    Estimated and cached counts cover the whole table, so filtered listings are only counted exactly, and only up to
+    pagination_filtered_count_limit rows so a filter matching most of the table does not cost a pass over it.
+    """
+    if strategy == CountStrategy.none:
+        return TotalCount(None)
+    if listing.is_filtered:
+        if strategy != CountStrategy.exact:
+            return TotalCount(None)
+        bound = settings.pagination_filtered_count_limit
+        count = await user_crud.get_users_count_bounded(db, listing, bound + 1)
+        return TotalCount(count if count <= bound else None)
+    if strategy == CountStrategy.cached:
+        return TotalCount(await user_crud.get_users_count_cached(db), approximate=True)
+    if strategy == CountStrategy.estimated:
+        # A never analyzed table has no estimate, and counting it exactly would exceed the route's query budget
+        estimate = await user_crud.get_users_count_estimate(db)
+        return TotalCount(estimate, approximate=estimate is not None)
+
+    return TotalCount(await user_crud.get_users_count(db=db))
+
+
+def _page_response(page: PaginatedResponse, request: Request, response: Response):
+    """
+    Return a page tagged with its ETag, or pre-encoded by pydantic-core when fast JSON responses are enabled
+    Answers 304 without serializing anything when the client already has this page.
+    """
+    etag = page_etag(page)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+
+    if settings.fast_json_responses:
+        # Rows were validated on write, re-validating them (EmailStr above all) dominates the encoding cost
+        content = construct_page(page, UserOut)
+        return PydanticJSONResponse(content, PaginatedResponse[UserOut], headers={'ETag': etag})
+
+    response.headers['ETag'] = etag
+    return page
+
+
+@router.get('/', response_model=PaginatedResponse[UserOut], dependencies=[Depends(query_budget(3))])
 async def list_users(
+    request: Request,
+    response: Response,
     db: Session,
     current_user: CurrentAdminUser,
-    filter: Annotated[FilterPage, Query()],
+    filter: Annotated[UserFilterPage, Query()],
     # skip: Annotated[int, Query(0, ge=0)],
     # limit: Annotated[int, Query(50, ge=1, le=200)],
 ):
-    response = user_crud.get_users(db, skip=filter.skip, limit=filter.limit)
-    total_count = user_crud.get_users_count(db=db)
+    strategy = filter.count or settings.pagination_count_strategy
+
+    # Refuse listings no index serves rather than scanning the whole table
+    try:
+        user_crud.listing_index(filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def cursor_key(user: User) -> str:
+        return listing_cursor_key(user, filter.sort)
+
+    if filter.cursor:
+        try:
+            key, direction = decode_cursor(filter.cursor)
+            # Fetch one extra row to know whether the seek can continue
+            users = await user_crud.get_users_by_cursor(
+                db, key, direction=direction, limit=filter.limit + 1, listing=filter
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail='invalid cursor')
+        # Counting would cost every page a pass over the listing, keyset pages only count when asked to
+        total_count = await _count_users(db, filter.count or CountStrategy.none, filter)
+
+        page = create_keyset_paginated_response(
+            items=users,
+            total_count=total_count,
+            limit=filter.limit,
+            direction=direction,
+            cursor_key=cursor_key,
+        )
+        return _page_response(page, request, response)
+
+    # Fetch one extra row so has_next does not depend on the count strategy
+    users = await user_crud.get_users(db, skip=filter.skip, limit=filter.limit + 1, listing=filter)
+    total_count = await _count_users(db, strategy, filter)
+
+    page = create_paginated_response(
+        items=users, total_count=total_count, skip=filter.skip, limit=filter.limit, cursor_key=cursor_key
+    )
+    return _page_response(page, request, response)
+
+
+@router.get('/export')
+async def export_users(
+    db: Session,
+    current_user: CurrentAdminUser,
+    format: Annotated[ExportFormat, Query()] = ExportFormat.ndjson,
+):
+    return StreamingResponse(
+        stream_export(user_crud.stream_users(db), UserOut, format),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename=users.{format.value}'},
+    )
 
-    return create_paginated_response(items=response, total_count=total_count, skip=filter.skip, limit=filter.limit)
 
+@router.get('/search', response_model=PaginatedResponse[UserOut], dependencies=[Depends(query_budget(2))])
+async def search_users(
+    db: Session,
+    current_user: CurrentAdminUser,
+    q: Annotated[str, Query(min_length=3, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=settings.search_max_results)] = 20,
+    cursor: Annotated[Optional[str], Query()] = None,
+):
+    after = None
+    if cursor:
+        try:
+            key, _ = decode_cursor(cursor)
+            rank, last_id = key.split('|')
+            after = (Decimal(rank), UUID(last_id))
+        except (ValueError, ArithmeticError):
+            raise HTTPException(status_code=400, detail='invalid cursor')
+
+    if not await user_crud.search_available(db):
+        raise HTTPException(status_code=503, detail='Search is unavailable: the pg_trgm extension is not installed')
+
+    # Fetch one extra row to know whether the search can continue
+    rows = await user_crud.search_users(db, q, limit=limit + 1, after=after)
+    has_next = len(rows) > limit
+    rows = rows[:limit]
 
-@router.post('/create_admin', response_model=UserOut, status_code=201)
+    next_cursor = None
+    if has_next:
+        last_user, last_rank = rows[-1]
+        next_cursor = encode_cursor(f'{last_rank}|{last_user.id}')
+
+    return PaginatedResponse(
+        items=[user for user, _ in rows],
+        total_count=None,
+        page=None,
+        page_size=limit,
+        total_pages=None,
+        has_next=has_next,
+        has_previous=after is not None,
+        next_cursor=next_cursor,
+    )
+
+
+@router.post('/create_admin', response_model=UserOut, status_code=201, dependencies=[Depends(query_budget(1))])
 async def create_admin_user(password: str, db: Session):
-    if user_crud.get_user_by_username(db, 'admin'):
+    try:
+        return await user_crud.create_admin(db, password)
+    except ValueError:
         raise HTTPException(status_code=409, detail='Admin user already exists')
 
-    return user_crud.create_admin(db, password)
-
 
-@router.post('/', response_model=UserOut, status_code=201)
+@router.post('/', response_model=UserOut, status_code=201, dependencies=[Depends(query_budget(2))])
 async def create_user(payload: UserCreate, db: Session, current_user: CurrentAdminUser):
-    # Checagens simples de unicidade (exemplo)
-    if user_crud.get_user_by_username(db, payload.username):
-        raise HTTPException(status_code=409, detail='username already exists')
-    if user_crud.get_user_by_email(db, payload.email):
-        raise HTTPException(status_code=409, detail='email already exists')
+    # Uniqueness is enforced by the INSERT itself, which names the conflicting field
+    try:
+        return await user_crud.create_user(db, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    # Delegar hashing e criação ao CRUD
-    return user_crud.create_user(db, payload)
 
+@router.post('/bulk', response_model=UserBulkResult, status_code=201)
+async def bulk_create_users(
+    payload: Annotated[List[UserCreate], Body(min_length=1, max_length=settings.bulk_create_max_users)],
+    db: Session,
+    current_user: CurrentAdminUser,
+):
+    return await user_crud.bulk_create_users(db, payload)
 
-@router.get('/{user_id}', response_model=UserOut)
+
+@router.get('/{user_id}', response_model=UserOut, dependencies=[Depends(query_budget(2))])
 async def get_user(
     user_id: UUID,
+    request: Request,
+    response: Response,
     db: Session,
     current_user: CurrentAdminUser,
 ):
-    user = user_crud.get_user_by_id(db, user_id)
+    user = await user_crud.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail='user not found')
+
+    # The row version alone tells whether the client copy is current, so skip serialization when it is
+    etag = user_etag(user)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+
+    response.headers['ETag'] = etag
     return user
 
 
-@router.patch('/{user_id}', response_model=UserOut)
+@router.patch('/{user_id}', response_model=UserOut, dependencies=[Depends(query_budget(3))])
 async def patch_user(
     user_id: UUID,
     payload: UserUpdate,
+    response: Response,
     db: Session,
     current_user: CurrentUser,
 ):
@@ -80,19 +245,19 @@ async def patch_user(
     if payload.is_admin is not None and not current_user.is_admin:
         raise HTTPException(status_code=401, detail='user unauthorized')
 
-    user = user_crud.get_user_by_id(db, user_id)
+    user = await user_crud.update_user(db, user_id, payload)
     if not user:
         raise HTTPException(status_code=404, detail='user not found')
-    return user_crud.update_user(db, user_id, payload)
+
+    response.headers['ETag'] = user_etag(user)
+    return user
 
 
-@router.delete('/{user_id}', status_code=204)
+@router.delete('/{user_id}', status_code=204, dependencies=[Depends(query_budget(3))])
 async def remove_user(
     user_id: UUID,
     db: Session,
     current_user: CurrentAdminUser,
 ):
-    user = user_crud.get_user_by_id(db, user_id)
-    if not user:
+    if not await user_crud.delete_user(db, user_id):
         raise HTTPException(status_code=404, detail='user not found')
-    user_crud.delete_user(db, user_id)
@@ -1,4 +1,5 @@
-from typing import Generic, List, TypeVar
+from enum import Enum
+from typing import Generic, List, Optional, TypeVar
 
 from pydantic import BaseModel, Field
 
@@ -12,14 +13,33 @@ class PaginatedResponse(BaseModel, Generic[T]):
     """
 
     items: List[T] = Field(..., description='List of items for current page')
-    total_count: int = Field(..., description='Total number of items available')
-    page: int = Field(..., description='Current page number (calculated from skip/limit)')
+    total_count: Optional[int] = Field(..., description='Total number of items available (null if not counted)')
+    page: Optional[int] = Field(..., description='Current page number (null in cursor mode)')
     page_size: int = Field(..., description='Number of items per page')
-    total_pages: int = Field(..., description='Total number of pages')
+    total_pages: Optional[int] = Field(..., description='Total number of pages (null if not counted)')
     has_next: bool = Field(..., description='Whether there are more pages')
     has_previous: bool = Field(..., description='Whether there are previous pages')
+    next_cursor: Optional[str] = Field(default=None, description='Opaque cursor for the next page')
+    prev_cursor: Optional[str] = Field(default=None, description='Opaque cursor for the previous page')
+    approximate_count: bool = Field(default=False, description='Whether total_count and total_pages are estimates')
+
+
+class CountStrategy(str, Enum):
+    exact = 'exact'
+    estimated = 'estimated'
+    cached = 'cached'
+    none = 'none'
+
+
+class SortOrder(str, Enum):
+    asc = 'asc'
+    desc = 'desc'
 
 
 class FilterPage(BaseModel):
     skip: int = Field(ge=0, default=0)
     limit: int = Field(ge=1, le=200, default=100)
+    cursor: Optional[str] = Field(default=None, description='Cursor from next_cursor/prev_cursor, skip is ignored')
+    count: Optional[CountStrategy] = Field(
+        default=None, description='How total_count is computed, cursor pages are not counted by default'
+    )
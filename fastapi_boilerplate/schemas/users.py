@@ -1,8 +1,11 @@
 from datetime import datetime
-from typing import Optional
+from enum import Enum
+from typing import FrozenSet, List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, field_validator
+
+from fastapi_boilerplate.schemas.pagination import FilterPage, SortOrder
 
 
 class UserBase(BaseModel):
@@ -32,3 +35,57 @@ class UserOut(UserBase):
 
     class Config:
         from_attributes = True
+
+
+class UserBulkConflict(BaseModel):
+    index: int
+    username: str
+    email: EmailStr
+    detail: str
+
+
+class UserBulkResult(BaseModel):
+    created: int
+    conflicts: List[UserBulkConflict]
+
+
+class UserSortKey(str, Enum):
+    username = 'username'
+    email = 'email'
+    created_at = 'created_at'
+
+
+class UserFilterPage(FilterPage):
+    is_admin: Optional[bool] = Field(default=None, description='Only admins (true) or only regular users (false)')
+    created_after: Optional[datetime] = Field(default=None, description='Only users created at or after this time')
+    created_before: Optional[datetime] = Field(default=None, description='Only users created before this time')
+    email_domain: Optional[str] = Field(default=None, max_length=255, description='Only users with this email domain')
+    sort: UserSortKey = Field(default=UserSortKey.username, description='Sort key, cursors are bound to it')
+    order: SortOrder = Field(default=SortOrder.asc, description='Sort direction')
+
+    @field_validator('email_domain')
+    @classmethod
+    def normalize_email_domain(cls, value: Optional[str]) -> Optional[str]:
+        # Stored emails carry the lowercased domain EmailStr normalizes to
+        return value.lower() if value else None
+
+    @property
+    def equality_filters(self) -> FrozenSet[str]:
+        """
+        Names of the filters matched by equality
+        """
+        return frozenset(name for name in ('is_admin', 'email_domain') if getattr(self, name) is not None)
+
+    @property
+    def is_filtered(self) -> bool:
+        """
+        Whether any filter narrows the listing
+        """
+        return bool(self.equality_filters) or self.created_after is not None or self.created_before is not None
+
+    @property
+    def is_default(self) -> bool:
+        """
+        Whether this is the plain username listing, served by the prepared hot statements
+        """
+        return not self.is_filtered and self.sort == UserSortKey.username and self.order == SortOrder.asc
@@ -0,0 +1,45 @@
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Response
+
+from fastapi_boilerplate.models.users import User
+from fastapi_boilerplate.schemas.pagination import PaginatedResponse
+
+
+def user_etag(user: User) -> str:
+    """
+    Strong ETag of a user representation, derived from its id and row version
+    """
+    return f'"{user.id.hex}-{user.version}"'
+
+
+def page_etag(page: PaginatedResponse) -> str:
+    """
+    Strong ETag of a page of users, derived from its metadata and the row versions of its items
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(page.model_dump(exclude={'items'}), sort_keys=True).encode())
+    for user in page.items:
+        digest.update(f'{user.id.hex}-{user.version};'.encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches etag, using weak comparison as RFC 9110 requires for GET
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(','))
+    return etag in (candidate.removeprefix('W/') for candidate in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Empty 304 response carrying the current ETag
+    """
+    return Response(status_code=304, headers={'ETag': etag})
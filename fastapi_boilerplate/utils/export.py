@@ -0,0 +1,66 @@
+import csv
+import io
+from typing import AsyncIterator, Type
+
+from pydantic import BaseModel
+
+from fastapi_boilerplate.schemas.export import ExportFormat
+
+# Flush the first row right away, then send reasonably sized chunks
+CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: 'application/x-ndjson',
+    ExportFormat.csv: 'text/csv',
+}
+
+
+async def _ndjson_lines(items: AsyncIterator, schema: Type[BaseModel]) -> AsyncIterator[str]:
+    async for item in items:
+        yield schema.model_validate(item).model_dump_json() + '\n'
+
+
+async def _csv_lines(items: AsyncIterator, schema: Type[BaseModel]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    fields = list(schema.model_fields)
+
+    writer.writerow(fields)
+    async for item in items:
+        row = schema.model_validate(item).model_dump(mode='json')
+        writer.writerow([row[field] for field in fields])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def stream_export(
+    items: AsyncIterator, schema: Type[BaseModel], export_format: ExportFormat
+) -> AsyncIterator[bytes]:
+    """
+    Serialize items through schema as NDJSON or CSV without materializing the full result
+    Args:
+        items: Async iterator of objects accepted by schema.model_validate
+        schema: Pydantic model used to serialize each item
+        export_format: Output format
+    Returns:
+        Async iterator of encoded chunks
+    """
+    lines = _csv_lines(items, schema) if export_format == ExportFormat.csv else _ndjson_lines(items, schema)
+
+    chunk = []
+    size = 0
+    first = True
+    async for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if first or size >= CHUNK_SIZE:
+            yield ''.join(chunk).encode()
+            chunk, size, first = [], 0, False
+
+    if chunk:
+        yield ''.join(chunk).encode()
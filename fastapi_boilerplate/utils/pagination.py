@@ -1,42 +1,151 @@
+import base64
+import json
 import math
-from typing import List, TypeVar
+from typing import Callable, List, NamedTuple, Optional, Tuple, TypeVar, Union
 
 from fastapi_boilerplate.schemas.pagination import PaginatedResponse
 
 T = TypeVar('T')
 
+CURSOR_DIRECTIONS = {'next', 'prev'}
 
-def create_paginated_response(items: List[T], total_count: int, skip: int, limit: int) -> PaginatedResponse[T]:
+
+class TotalCount(NamedTuple):
+    value: Optional[int]
+    approximate: bool = False
+
+
+def encode_cursor(key: str, direction: str = 'next') -> str:
+    """
+    Encode a keyset position as an opaque cursor
+    """
+    raw = json.dumps({'k': key, 'd': direction}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode an opaque cursor into its key and direction
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key, direction = data['k'], data['d']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(key, str) or direction not in CURSOR_DIRECTIONS:
+        raise ValueError('Invalid cursor')
+    return key, direction
+
+
+def _total_count(total_count: Union[int, TotalCount, None]) -> TotalCount:
+    if isinstance(total_count, TotalCount):
+        return total_count
+    return TotalCount(total_count)
+
+
+def _total_pages(total_count: Optional[int], limit: int) -> Optional[int]:
+    if total_count is None:
+        return None
+    return math.ceil(total_count / limit) if limit > 0 else 1
+
+
+def create_paginated_response(
+    items: List[T],
+    total_count: Union[int, TotalCount, None],
+    skip: int,
+    limit: int,
+    cursor_key: Optional[Callable[[T], str]] = None,
+) -> PaginatedResponse[T]:
     """
     Create a paginated response with all pagination metadata
     Args:
-        items: List of items for current page
-        total_count: Total number of items available
+        items: List of items for current page, optionally followed by one extra item signaling a next page
+        total_count: Total number of items available, as a TotalCount when approximate or not counted
         skip: Number of items skipped
         limit: Number of items per page
+        cursor_key: Optional function returning the keyset value of an item, used to emit cursors
     Returns:
         PaginatedResponse with pagination metadata
     """
+    total_count = _total_count(total_count)
+
+    # An extra row tells whether there is a next page regardless of the count
+    has_more = len(items) > limit
+    items = list(items[:limit])
 
     # Calculate current page (1-based)
     current_page = (skip // limit) + 1 if limit > 0 else 1
 
     # Calculate total pages
-    total_pages = math.ceil(total_count / limit) if limit > 0 else 1
+    total_pages = _total_pages(total_count.value, limit)
 
-    # Calculate pagination flags
-    has_next = current_page < total_pages
+    # Calculate pagination flags, trusting only the extra row when the count is estimated or missing
+    if total_count.approximate or total_pages is None:
+        has_next = has_more
+    else:
+        has_next = has_more or current_page < total_pages
     has_previous = current_page > 1
 
+    # Let clients switch to cursor mode from any offset page
+    next_cursor = encode_cursor(cursor_key(items[-1]), 'next') if cursor_key and has_next and items else None
+    prev_cursor = encode_cursor(cursor_key(items[0]), 'prev') if cursor_key and has_previous and items else None
+
     return PaginatedResponse(
         items=items,
-        total_count=total_count,
+        total_count=total_count.value,
         page=current_page,
         page_size=limit,
         total_pages=total_pages,
         has_next=has_next,
         has_previous=has_previous,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        approximate_count=total_count.approximate,
     )
 
 
-1
+def create_keyset_paginated_response(
+    items: List[T],
+    total_count: Union[int, TotalCount, None],
+    limit: int,
+    direction: str,
+    cursor_key: Callable[[T], str],
+) -> PaginatedResponse[T]:
+    """
+    Create a paginated response for a keyset (cursor) page
+    Args:
+        items: Up to limit + 1 items in seek order (descending when direction is 'prev')
+        total_count: Total number of items available, as a TotalCount when approximate or not counted
+        limit: Number of items per page
+        direction: Direction of the cursor that produced the page ('next' or 'prev')
+        cursor_key: Function returning the keyset value of an item
+    Returns:
+        PaginatedResponse with cursors for the adjacent pages
+    """
+    total_count = _total_count(total_count)
+
+    # The extra row only tells whether the seek can continue
+    has_more = len(items) > limit
+    items = list(items[:limit])
+
+    if direction == 'prev':
+        items.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, True
+
+    return PaginatedResponse(
+        items=items,
+        total_count=total_count.value,
+        page=None,
+        page_size=limit,
+        total_pages=_total_pages(total_count.value, limit),
+        has_next=has_next,
+        has_previous=has_previous,
+        next_cursor=encode_cursor(cursor_key(items[-1]), 'next') if has_next and items else None,
+        prev_cursor=encode_cursor(cursor_key(items[0]), 'prev') if has_previous and items else None,
+        approximate_count=total_count.approximate,
+    )
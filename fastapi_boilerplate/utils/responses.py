@@ -0,0 +1,56 @@
+from functools import lru_cache
+from typing import Any, Optional, Type, TypeVar
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+from starlette.background import BackgroundTask
+
+from fastapi_boilerplate.schemas.pagination import PaginatedResponse
+
+M = TypeVar('M', bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def type_adapter(model_type: Any) -> TypeAdapter:
+    """
+    Return a TypeAdapter for model_type, building its core schema and serializer only once
+    """
+    return TypeAdapter(model_type)
+
+
+def construct_from_attributes(model_type: Type[M], obj: Any) -> M:
+    """
+    Build model_type from the attributes of obj without validation
+    Only meant for trusted data such as rows that were validated when written.
+    """
+    return model_type.model_construct(**{name: getattr(obj, name) for name in model_type.model_fields})
+
+
+def construct_page(page: PaginatedResponse, item_type: Type[M]) -> PaginatedResponse[M]:
+    """
+    Rebuild a page of ORM objects as PaginatedResponse[item_type] without validation
+    """
+    items = [construct_from_attributes(item_type, item) for item in page.items]
+    return PaginatedResponse[item_type].model_construct(**dict(page, items=items))
+
+
+class PydanticJSONResponse(JSONResponse):
+    """
+    JSON response encoded to bytes by pydantic-core
+    Skips FastAPI's response model round trip (dump, validate, dump again) and jsonable_encoder.
+    """
+
+    def __init__(
+        self,
+        content: Any,
+        model_type: Any,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        background: Optional[BackgroundTask] = None,
+    ) -> None:
+        # render() runs inside JSONResponse.__init__
+        self.model_type = model_type
+        super().__init__(content, status_code=status_code, headers=headers, background=background)
+
+    def render(self, content: Any) -> bytes:
+        return type_adapter(self.model_type).dump_json(content)
@@ -0,0 +1,30 @@
+"""drop users id index
+
+Revision ID: 0d6b3f81c7e2
+Revises: e41c7a9d2f58
+Create Date: 2026-10-18 21:36:52.804117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d6b3f81c7e2'
+down_revision: Union[str, Sequence[str], None] = 'e41c7a9d2f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # users_pkey already serves every lookup by id, this copy only slowed down writes
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_users_id')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_id ON users (id)')
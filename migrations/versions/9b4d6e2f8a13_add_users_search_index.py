@@ -0,0 +1,38 @@
+"""add users search index
+
+Revision ID: 9b4d6e2f8a13
+Revises: 5c2e9a7d41b3
+Create Date: 2026-10-18 20:58:41.502117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4d6e2f8a13'
+down_revision: Union[str, Sequence[str], None] = '5c2e9a7d41b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match fastapi_boilerplate.models.users.SEARCH_DOCUMENT for the planner to use the index
+SEARCH_DOCUMENT = "username || ' ' || email || ' ' || first_name || ' ' || last_name"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Build without blocking writes on a large users table
+    with op.get_context().autocommit_block():
+        op.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_search_trgm '
+            f'ON users USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)'
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # pg_trgm is left installed, other objects may depend on it
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_users_search_trgm')
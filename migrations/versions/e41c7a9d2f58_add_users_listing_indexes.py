@@ -0,0 +1,43 @@
+"""add users listing indexes
+
+Revision ID: e41c7a9d2f58
+Revises: 9b4d6e2f8a13
+Create Date: 2026-10-18 21:14:05.330961
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41c7a9d2f58'
+down_revision: Union[str, Sequence[str], None] = '9b4d6e2f8a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match fastapi_boilerplate.models.users.EMAIL_DOMAIN for the planner to use the indexes
+EMAIL_DOMAIN = "split_part(email, '@', 2)"
+
+INDEXES = {
+    'ix_users_created_at_id': 'created_at, id',
+    'ix_users_is_admin_username': 'is_admin, username',
+    'ix_users_is_admin_created_at_id': 'is_admin, created_at, id',
+    'ix_users_email_domain_username': f'({EMAIL_DOMAIN}), username',
+    'ix_users_email_domain_created_at_id': f'({EMAIL_DOMAIN}), created_at, id',
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Build without blocking writes on a large users table
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users ({columns})')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -1,44 +1,59 @@
 from http import HTTPStatus
 
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from testcontainers.postgres import PostgresContainer
 
 from fastapi_boilerplate.app import app_test_env
-from fastapi_boilerplate.core.database import get_session
+from fastapi_boilerplate.core.cache import principal_cache, search_available_cache, token_cache, users_count_cache
+from fastapi_boilerplate.core.database import get_session, instrument_engine
 from fastapi_boilerplate.core.settings import settings
+from fastapi_boilerplate.core.throttle import MemoryThrottleBackend, login_throttle
 from fastapi_boilerplate.models.base import Base
 
 
 @pytest.fixture(scope='session')
 def engine():
     with PostgresContainer('postgres:17', driver='psycopg') as postgres:
-        _engine = create_engine(postgres.get_connection_url())
+        _engine = create_async_engine(postgres.get_connection_url())
+        instrument_engine(_engine)
         yield _engine
 
 
-@pytest.fixture
-def db_session(engine):
-    # Drop Database when starting the tests
-    Base.metadata.drop_all(engine)
+@pytest_asyncio.fixture
+async def db_session(engine):
+    async with engine.begin() as conn:
+        # Drop Database when starting the tests
+        await conn.run_sync(Base.metadata.drop_all)
 
-    # Create tables
-    Base.metadata.create_all(engine)
+        # Create tables
+        await conn.run_sync(Base.metadata.create_all)
 
     # Create Session and return
-    with Session(engine) as session:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
 
     # Drop Database after finishing the tests
-    Base.metadata.drop_all(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
 
 
 @pytest.fixture
-def client(db_session: Session):
+def client(db_session: AsyncSession, monkeypatch):
     """Create a TestClient with authenticated headers"""
 
+    # Fail any route that issues more queries than its declared budget
+    monkeypatch.setattr(settings, 'query_budget_strict', True)
+
+    # Cached principals would outlive the per-test database
+    principal_cache.clear()
+    token_cache.clear()
+    users_count_cache.clear()
+    search_available_cache.clear()
+    monkeypatch.setattr(login_throttle, 'backend', MemoryThrottleBackend())
+
     # Override session to use the Test DB
     app_test_env.dependency_overrides[get_session] = lambda: db_session
     with TestClient(app_test_env) as test_client:
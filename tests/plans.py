@@ -0,0 +1,111 @@
+"""
+Query plan inspection, used to pin how PostgreSQL executes the statements the application issues.
+
+capture_statements records what an engine sends, explain returns the planner's estimated plan for it without
+running it, and table_indexes / duplicate_indexes describe the indexes a table carries.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Plan nodes that sort rows in memory or on disk instead of reading them in index order
+SORT_NODES = {'Sort', 'Incremental Sort'}
+
+
+@dataclass(frozen=True)
+class IndexInfo:
+    name: str
+    unique: bool
+    method: str
+    columns: Tuple[str, ...]
+    predicate: Optional[str] = None
+
+
+@contextmanager
+def capture_statements(engine: AsyncEngine) -> Iterator[List[Tuple[str, Any]]]:
+    """
+    Record the SQL text and parameters of every statement the engine executes
+    """
+    captured = []
+
+    def record(statement, parameters, executemany, **kw):
+        if not executemany:
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', record, named=True)
+    try:
+        yield captured
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', record)
+
+
+async def explain(conn: AsyncConnection, statement: str, parameters: Any = None) -> dict:
+    """
+    Return the root node of the planner's estimated plan for a statement, without running it
+    """
+    result = await conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters or {})
+    return result.scalar()[0]['Plan']
+
+
+def plan_nodes(plan: dict) -> Iterator[dict]:
+    """
+    Walk a plan node and all of its children, depth first
+    """
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def plan_indexes(plan: dict) -> Set[str]:
+    """
+    Names of the indexes a plan scans
+    """
+    return {node['Index Name'] for node in plan_nodes(plan) if 'Index Name' in node}
+
+
+async def table_indexes(conn: AsyncConnection, table: str) -> List[IndexInfo]:
+    """
+    Describe the indexes of a table, key columns spelled as in their definition
+    """
+    result = await conn.execute(
+        text(
+            'SELECT i.relname, ix.indisunique, am.amname, pg_get_expr(ix.indpred, ix.indrelid), '
+            'ARRAY(SELECT pg_get_indexdef(ix.indexrelid, k, true) FROM generate_series(1, ix.indnkeyatts) k) '
+            'FROM pg_index ix JOIN pg_class i ON i.oid = ix.indexrelid JOIN pg_am am ON am.oid = i.relam '
+            'WHERE ix.indrelid = CAST(:table AS regclass) ORDER BY i.relname'
+        ),
+        {'table': table},
+    )
+    return [
+        IndexInfo(name=name, unique=unique, method=method, columns=tuple(columns), predicate=predicate)
+        for name, unique, method, predicate, columns in result
+    ]
+
+
+def duplicate_indexes(indexes: List[IndexInfo]) -> List[Tuple[str, str]]:
+    """
+    Find (redundant, covering) index pairs: a non-unique index whose key columns lead another index of the same
+    method and predicate, so the other one serves all of its lookups while both are maintained on every write
+    """
+    duplicates = []
+    for redundant in indexes:
+        if redundant.unique:
+            continue
+        for covering in indexes:
+            same_kind = (covering.method, covering.predicate) == (redundant.method, redundant.predicate)
+            if covering is redundant or not same_kind:
+                continue
+            # Only btree lookups are served by an index merely led by the same columns
+            width = len(redundant.columns) if redundant.method == 'btree' else None
+            if covering.columns[:width] != redundant.columns:
+                continue
+            # Of two identical non-unique indexes, report only one
+            if covering.columns == redundant.columns and not covering.unique and covering.name > redundant.name:
+                continue
+            duplicates.append((redundant.name, covering.name))
+            break
+    return duplicates
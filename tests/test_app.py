@@ -1,8 +1,37 @@
+import asyncio
+import zlib
 from http import HTTPStatus
 
+import pytest
+import pytest_asyncio
+import zstandard
 from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlalchemy import event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from starlette.requests import Request
 
 from fastapi_boilerplate.app import app_test_env
+from fastapi_boilerplate.core import pool, routing
+from fastapi_boilerplate.core.cache import users_count_cache
+from fastapi_boilerplate.core.database import create_database_engine, instrument_engine
+from fastapi_boilerplate.core.metrics import db_statement_executions_total
+from fastapi_boilerplate.core.middleware import CompressionMiddleware
+from fastapi_boilerplate.core.pool import InstrumentedAsyncQueuePool, PoolStatsRegistry
+from fastapi_boilerplate.core.routing import (
+    MemoryRecentWritesBackend,
+    ReplicaSet,
+    RoutingSession,
+    record_writes,
+    session_info,
+    sibling_session,
+)
+from fastapi_boilerplate.core.security import create_access_token
+from fastapi_boilerplate.core.settings import Settings, settings
+from fastapi_boilerplate.core.startup import SchemaOutOfDate, prepare_schema, run_exclusively, schema_ready
+from fastapi_boilerplate.crud.users import user_crud
+from fastapi_boilerplate.models.base import Base
+from fastapi_boilerplate.schemas.users import UserCreate
 
 
 def test_app_online():
@@ -10,3 +39,326 @@ def test_app_online():
     response = client.get('/api/v1/health')
     assert response.status_code == HTTPStatus.OK
     assert response.json() == {'status': 'healthy'}
+
+
+def test_pool_status(client, admin_token, monkeypatch):
+    response = client.get('/api/v1/health/pool')
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+    # Same policy as /metrics, which publishes the same pool state
+    monkeypatch.setattr(settings, 'metrics_token', 'scraper-token')
+    response = client.get('/api/v1/health/pool', headers={'Authorization': 'Bearer scraper-token'})
+    assert response.status_code == HTTPStatus.OK
+
+    response = client.get('/api/v1/health/pool', headers={'Authorization': f'Bearer {admin_token}'})
+    assert response.status_code == HTTPStatus.OK
+    pools = response.json()['pools']
+    assert {'size', 'checked_out', 'overflow', 'timeouts', 'wait_seconds'} <= pools['primary'].keys()
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_record_waits_and_timeouts_per_pool(engine, monkeypatch):
+    stats = PoolStatsRegistry()
+    monkeypatch.setattr(pool, 'pool_stats', stats)
+    primary, replica = (
+        create_async_engine(
+            engine.url,
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.1,
+            pool_logging_name=name,
+        )
+        for name in ('primary', 'replica-1')
+    )
+
+    async with primary.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+        with pytest.raises(exc.TimeoutError):
+            async with primary.connect():
+                pass
+        snapshot = stats.snapshot()
+        assert snapshot['primary']['checked_out'] == 1
+    async with replica.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+
+    # Disposal recreates the pools, their stats carry over
+    await primary.dispose()
+    await replica.dispose()
+    snapshot = stats.snapshot()
+    assert snapshot['primary']['wait_seconds']['count'] == 2  # noqa: PLR2004
+    assert snapshot['primary']['timeouts'] == 1
+    assert snapshot['replica-1']['wait_seconds']['count'] == 1
+    assert snapshot['replica-1']['timeouts'] == 0
+
+    lines = stats.collect()
+    assert lines.count('# TYPE db_pool_timeouts_total counter') == 1
+    assert 'db_pool_timeouts_total{pool="primary"} 1' in lines
+    assert 'db_pool_timeouts_total{pool="replica-1"} 0' in lines
+    assert 'db_pool_wait_seconds_count{pool="replica-1"} 1' in lines
+
+
+def test_metrics_endpoint_records_route_templates(monkeypatch):
+    monkeypatch.setattr(settings, 'metrics_token', 'scraper-token')
+    client = TestClient(app_test_env)
+    client.get('/api/v1/health')
+    client.get('/api/v1/does-not-exist')
+
+    assert client.get('/metrics').status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == HTTPStatus.UNAUTHORIZED
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scraper-token'})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith('text/plain')
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/api/v1/health",status="200"}' in body
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/v1/health",le="+Inf"}' in body
+    assert '# TYPE db_pool_wait_seconds histogram' in body
+
+
+def _streaming_app(chunks):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+        for i, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': i < len(chunks) - 1})
+
+    return app
+
+
+async def _call(app, accept_encoding):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({'type': 'http', 'headers': [(b'accept-encoding', accept_encoding)]}, None, send)
+    return dict(messages[0]['headers']), [message['body'] for message in messages[1:]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ('encoding', 'decoder'),
+    [
+        ('gzip', lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+        ('zstd', lambda: zstandard.ZstdDecompressor().decompressobj()),
+    ],
+)
+async def test_compression_streams_chunks_incrementally(encoding, decoder):
+    chunks = [f'chunk {i} '.encode() * 40 for i in range(3)]
+    app = CompressionMiddleware(_streaming_app(chunks), encodings=['zstd', 'gzip'], minimum_size=1024)
+
+    headers, bodies = await _call(app, f'{encoding}, br;q=0.5'.encode())
+    assert headers[b'content-encoding'] == encoding.encode()
+    assert headers[b'vary'] == b'Accept-Encoding'
+
+    # Every chunk is sent as soon as it is produced and decodes on its own
+    decompressor = decoder()
+    assert len(bodies) == len(chunks)
+    for chunk, body in zip(chunks, bodies):
+        assert decompressor.decompress(body) == chunk
+
+
+@pytest.mark.asyncio
+async def test_compression_skips_small_bodies_and_refused_encodings():
+    app = CompressionMiddleware(_streaming_app([b'small']), encodings=['gzip'], minimum_size=1024)
+    headers, bodies = await _call(app, b'gzip')
+    assert b'content-encoding' not in headers
+    assert bodies == [b'small']
+
+    app = CompressionMiddleware(_streaming_app([b'x' * 2048]), encodings=['gzip'], minimum_size=1024)
+    headers, bodies = await _call(app, b'gzip;q=0, zstd')
+    assert b'content-encoding' not in headers
+
+
+@pytest.mark.asyncio
+async def test_startup_tasks_never_run_concurrently(engine):
+    running, overlaps = 0, 0
+
+    async def task():
+        nonlocal running, overlaps
+        running += 1
+        overlaps += running > 1
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    results = await asyncio.gather(*(run_exclusively(engine, task) for _ in range(3)))
+    assert results == [True, True, True]
+    assert overlaps == 0
+
+
+@pytest.mark.asyncio
+async def test_waiting_processes_do_not_redo_startup_tasks(db_session, engine):
+    payload = {'username': 'admin', 'email': 'a@example.com', 'first_name': 'A', 'last_name': 'A', 'password': 'x'}
+
+    async def create_admin():
+        async with AsyncSession(engine) as session:
+            await user_crud.create_user(session, UserCreate(**payload))
+
+    async def startup_done():
+        async with AsyncSession(engine) as session:
+            return await user_crud.get_user_by_username(session, 'admin') is not None
+
+    async def run_startup():
+        return await run_exclusively(
+            engine, lambda: prepare_schema(engine, 'create_all'), create_admin, is_done=startup_done
+        )
+
+    results = await asyncio.gather(*(run_startup() for _ in range(3)))
+    assert sorted(results) == [False, False, True]
+
+    # Once done, a restart only checks the marker
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', record)
+    try:
+        assert await run_startup() is False
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', record)
+    writes = [statement for statement in statements if statement.split(None, 1)[0].upper() in {'CREATE', 'INSERT'}]
+    assert writes == []
+    assert await schema_ready(engine, 'create_all')
+
+
+@pytest.mark.asyncio
+async def test_startup_skips_tasks_while_another_process_runs_them(engine, monkeypatch):
+    monkeypatch.setattr(settings, 'startup_lock_mode', 'skip')
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def leader_task():
+        started.set()
+        await release.wait()
+
+    async def follower_task():
+        raise AssertionError('only the lock holder runs the startup tasks')
+
+    leader = asyncio.create_task(run_exclusively(engine, leader_task))
+    await started.wait()
+    assert await run_exclusively(engine, follower_task) is False
+    release.set()
+    assert await leader is True
+
+
+@pytest.mark.asyncio
+async def test_alembic_schema_mode_requires_migrations_at_head(db_session, engine):
+    with pytest.raises(SchemaOutOfDate, match='alembic upgrade head'):
+        await prepare_schema(engine, 'alembic')
+
+
+@pytest.mark.parametrize('field', ['startup_schema_mode', 'startup_lock_mode'])
+def test_startup_modes_are_validated(field):
+    with pytest.raises(ValidationError, match=field):
+        Settings(**{field: 'bogus'})
+
+
+@pytest.mark.asyncio
+async def test_create_all_without_privileges_to_create_extensions(engine):
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            # A role that does not own the database, with a schema of its own to create the tables in
+            await conn.execute(text('DROP EXTENSION IF EXISTS pg_trgm CASCADE'))
+            await conn.execute(text('CREATE ROLE limited_app'))
+            await conn.execute(text('CREATE SCHEMA limited AUTHORIZATION limited_app'))
+            await conn.execute(text('SET LOCAL ROLE limited_app'))
+            await conn.execute(text('SET LOCAL search_path TO limited'))
+
+            await conn.run_sync(Base.metadata.create_all)
+            assert await conn.scalar(text("SELECT to_regclass('limited.users') IS NOT NULL"))
+            assert not await conn.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"))
+            assert not await conn.scalar(text("SELECT to_regclass('limited.ix_users_search_trgm') IS NOT NULL"))
+        finally:
+            await transaction.rollback()
+
+
+@pytest_asyncio.fixture
+async def replica(engine, monkeypatch):
+    # Same server, separate engine: enough to tell which one a statement went to
+    replica = create_async_engine(engine.url)
+    statements = []
+    event.listen(replica.sync_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    monkeypatch.setattr(routing, 'recent_writes', MemoryRecentWritesBackend())
+    yield replica, statements
+    await replica.dispose()
+
+
+@pytest.mark.asyncio
+async def test_routing_session_reads_from_replica_until_first_write(db_session, engine, replica):
+    replica, statements = replica
+    info = {'principal': 'alice', 'replica': replica}
+    async with AsyncSession(engine, sync_session_class=RoutingSession, expire_on_commit=False, info=info) as session:
+        assert await user_crud.get_users_count(session) == 0
+        assert len(statements) == 1
+
+        payload = {'username': 'bob', 'email': 'bob@example.com', 'first_name': 'B', 'last_name': 'B', 'password': 'x'}
+        await user_crud.create_user(session, UserCreate(**payload))
+        assert await user_crud.get_users_count(session) == 1
+        assert len(statements) == 1
+
+        await record_writes(session)
+    assert await routing.recent_writes.wrote_recently('alice')
+
+
+@pytest.mark.asyncio
+async def test_users_count_cache_refreshes_on_the_primary(db_session, engine, replica):
+    replica, statements = replica
+    users_count_cache.clear()
+    info = {'principal': 'alice', 'replica': replica}
+    async with AsyncSession(engine, sync_session_class=RoutingSession, expire_on_commit=False, info=info) as session:
+        async with sibling_session(session) as sibling:
+            await user_crud.get_users_count(sibling)
+        assert len(statements) == 1
+
+        assert await user_crud.get_users_count_cached(session) == 0
+        assert len(statements) == 1
+    users_count_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_session_info_skips_lagging_replicas_and_recent_writers(engine, replica, monkeypatch):
+    replica, _ = replica
+    token = create_access_token({'sub': 'alice'})
+
+    def request(method):
+        headers = [(b'authorization', f'Bearer {token}'.encode())]
+        return Request({'type': 'http', 'method': method, 'headers': headers})
+
+    replicas = ReplicaSet([replica])
+    assert (await session_info(request('GET'), replicas))['replica'] is replica
+    assert (await session_info(request('POST'), replicas))['replica'] is None
+
+    # Reads follow the principal's own writes to the primary for a while
+    await routing.recent_writes.mark('alice', settings.read_your_writes_seconds)
+    assert (await session_info(request('GET'), replicas))['replica'] is None
+    monkeypatch.setattr(routing, 'recent_writes', MemoryRecentWritesBackend())
+
+    monkeypatch.setattr(settings, 'replica_max_lag_seconds', -1)
+    assert (await session_info(request('GET'), replicas))['replica'] is None
+
+
+def _statement_executions(name):
+    line = f'db_statement_executions_total{{statement="{name}"}} '
+    return next(
+        (float(sample[len(line) :]) for sample in db_statement_executions_total.collect() if sample.startswith(line)),
+        0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_hot_statements_are_prepared_and_counted(db_session, engine, monkeypatch):
+    monkeypatch.setattr(settings, 'database_prepare_threshold', 2)
+    prepared_engine = create_database_engine(engine.url)
+    instrument_engine(prepared_engine)
+    executions = _statement_executions('user_by_username')
+
+    async with AsyncSession(prepared_engine) as session:
+        for _ in range(3):
+            await user_crud.get_user_by_username(session, 'nobody')
+        prepared = (await session.scalars(text('SELECT statement FROM pg_prepared_statements'))).all()
+
+    await prepared_engine.dispose()
+    assert _statement_executions('user_by_username') == executions + 3
+    assert any('users.username = $1' in statement for statement in prepared)
@@ -1,6 +1,29 @@
+import time
 from http import HTTPStatus
 
 import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from jwt import PyJWK, decode, get_unverified_header
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+
+from fastapi_boilerplate.app import app_test_env
+from fastapi_boilerplate.core.cache import principal_cache, token_cache
+from fastapi_boilerplate.core.database import get_session
+from fastapi_boilerplate.core.security import (
+    HashingUnavailable,
+    create_access_token,
+    get_password_hash_async,
+    verify_token,
+)
+from fastapi_boilerplate.core.settings import MAX_LOGIN_FAILURES_PER_KEY, Settings, settings
+from fastapi_boilerplate.core.throttle import LoginThrottle, ThrottleBackend, request_client_ip
+from fastapi_boilerplate.crud.users import user_crud
 
 
 @pytest.fixture
@@ -46,6 +69,39 @@ def test_login_invalid_credentials(client, user_payload, created_user):
     assert response.status_code == HTTPStatus.UNAUTHORIZED
 
 
+def test_login_rejected_when_hash_queue_full(client, user_payload, created_user, monkeypatch):
+    monkeypatch.setattr(settings, 'password_hash_max_pending', 0)
+    payload = {'username': user_payload['username'], 'password': user_payload['password']}
+    response = client.post(
+        '/api/v1/auth/login', data=payload, headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers['Retry-After'] == '1'
+
+
+@pytest.mark.asyncio
+async def test_hashing_unavailable_when_queue_full(monkeypatch):
+    monkeypatch.setattr(settings, 'password_hash_max_pending', 0)
+    with pytest.raises(HashingUnavailable):
+        await get_password_hash_async('secret123')
+
+
+def test_login_throttled_before_authentication(client, user_payload, created_user, monkeypatch):
+    payload = {'username': user_payload['username'], 'password': 'wrongpassword'}
+    for _ in range(settings.login_max_failures_per_username):
+        response = client.post('/api/v1/auth/login', data=payload)
+        assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+    async def authenticate_user(*args, **kwargs):
+        raise AssertionError('throttled attempts must not reach authentication')
+
+    monkeypatch.setattr(user_crud, 'authenticate_user', authenticate_user)
+    payload['password'] = user_payload['password']
+    response = client.post('/api/v1/auth/login', data=payload)
+    assert response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert int(response.headers['Retry-After']) >= 1
+
+
 def test_get_current_user_success(client, user_payload, created_user):
     payload = {'username': user_payload['username'], 'password': user_payload['password']}
     response = client.post(
@@ -80,3 +136,206 @@ def test_refresh_token(client, user_payload, created_user):
     assert 'access_token' in data
     assert data['token_type'] == 'bearer'
     assert data['expires_in'] > 0
+
+
+def test_current_user_is_cached(client, user_payload, created_user):
+    payload = {'username': user_payload['username'], 'password': user_payload['password']}
+    response = client.post(
+        '/api/v1/auth/login', data=payload, headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    client.get('/api/v1/auth/user', headers=headers)
+    before = principal_cache.stats()
+
+    response = client.get('/api/v1/auth/user', headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    after = principal_cache.stats()
+    assert after['hits'] == before['hits'] + 1
+    assert after['misses'] == before['misses']
+
+
+def test_revoked_admin_privileges_apply_immediately(client, admin_token, user_payload):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.post('/api/v1/users/', json={**user_payload, 'is_admin': True})
+    user_id = r.json()['id']
+
+    payload = {'username': user_payload['username'], 'password': user_payload['password']}
+    response = client.post(
+        '/api/v1/auth/login', data=payload, headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    user_headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    assert client.get('/api/v1/auth/admin', headers=user_headers).status_code == HTTPStatus.OK
+
+    r = client.patch(f'/api/v1/users/{user_id}', json={'is_admin': False})
+    assert r.status_code == HTTPStatus.OK
+    before = principal_cache.stats()
+    assert client.get('/api/v1/auth/admin', headers=user_headers).status_code == HTTPStatus.FORBIDDEN
+    after = principal_cache.stats()
+    assert after['misses'] == before['misses'] + 1
+
+
+def test_cached_principal_survives_rollback_of_its_session(client, engine, admin_token, user_payload, monkeypatch):
+    async def fresh_session():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    # Give every request its own session, as in production
+    monkeypatch.setitem(app_test_env.dependency_overrides, get_session, fresh_session)
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    assert client.post('/api/v1/users/', json=user_payload).status_code == HTTPStatus.CREATED
+
+    # The principal is loaded by the request whose duplicate insert rolls its session back
+    principal_cache.clear()
+    assert client.post('/api/v1/users/', json=user_payload).status_code == HTTPStatus.CONFLICT
+
+    r = client.get('/api/v1/auth/admin')
+    assert r.status_code == HTTPStatus.OK
+    assert r.json() == {'username': 'admin', 'is_admin': True}
+
+
+def test_verify_token_caches_payload_until_expiry(monkeypatch):
+    token_cache.clear()
+    token = create_access_token({'sub': 'someone'})
+
+    assert verify_token(token)['sub'] == 'someone'
+    assert verify_token(token)['sub'] == 'someone'
+    assert token_cache.stats()['hits'] == 1
+
+    # A cached payload is never served past the token expiry
+    expires_at = time.time() + settings.access_token_expire_minutes * 60
+    monkeypatch.setattr(time, 'time', lambda: expires_at + 1)
+    assert verify_token(token) is None
+
+
+def test_verify_token_rejects_cached_token_after_secret_rotation(monkeypatch):
+    token_cache.clear()
+    token = create_access_token({'sub': 'someone'})
+    assert verify_token(token) is not None
+
+    monkeypatch.setattr(settings, 'secret_key', 'rotated-secret')
+    assert verify_token(token) is None
+
+
+def _write_key(path, private_key):
+    path.write_bytes(
+        private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    )
+    return str(path)
+
+
+@pytest.mark.parametrize(
+    ('algorithm', 'generate'),
+    [('EdDSA', Ed25519PrivateKey.generate), ('RS256', lambda: rsa.generate_private_key(65537, 2048))],
+)
+def test_asymmetric_tokens_rotate_through_jwks(tmp_path, monkeypatch, algorithm, generate):
+    token_cache.clear()
+    client = TestClient(app_test_env)
+    old_key = _write_key(tmp_path / 'old.pem', generate())
+    new_key = _write_key(tmp_path / 'new.pem', generate())
+    monkeypatch.setattr(settings, 'algorithm', algorithm)
+    monkeypatch.setattr(settings, 'jwt_private_key_path', old_key)
+    old_token = create_access_token({'sub': 'someone'})
+
+    # Rotate: sign with the new key, keep the old one verifiable
+    monkeypatch.setattr(settings, 'jwt_private_key_path', new_key)
+    monkeypatch.setattr(settings, 'jwt_retired_key_paths', old_key)
+    new_token = create_access_token({'sub': 'someone'})
+
+    r = client.get('/.well-known/jwks.json')
+    assert r.status_code == HTTPStatus.OK
+    assert r.headers['cache-control'] == f'public, max-age={settings.jwks_max_age_seconds}'
+    jwks = {key['kid']: key for key in r.json()['keys']}
+    assert get_unverified_header(old_token)['kid'] in jwks
+    assert get_unverified_header(new_token)['kid'] in jwks
+    assert {key['alg'] for key in jwks.values()} == {algorithm}
+
+    # Downstream services verify with the published keys alone
+    jwk = jwks[get_unverified_header(new_token)['kid']]
+    assert decode(new_token, PyJWK(jwk).key, algorithms=[algorithm])['sub'] == 'someone'
+
+    assert verify_token(old_token)['sub'] == 'someone'
+    assert verify_token(new_token)['sub'] == 'someone'
+
+    # Once retired for good, the old key's tokens are rejected, cached or not
+    monkeypatch.setattr(settings, 'jwt_retired_key_paths', None)
+    assert verify_token(old_token) is None
+    assert verify_token(new_token)['sub'] == 'someone'
+
+
+def test_asymmetric_mode_rejects_secret_signed_tokens(tmp_path, monkeypatch):
+    hs_token = create_access_token({'sub': 'someone'})
+    monkeypatch.setattr(settings, 'algorithm', 'EdDSA')
+    monkeypatch.setattr(
+        settings, 'jwt_private_key_path', _write_key(tmp_path / 'key.pem', Ed25519PrivateKey.generate())
+    )
+    assert verify_token(hs_token) is None
+
+
+class SharedStoreBackend(ThrottleBackend):
+    """Stand-in for a shared store such as Redis, holding plain data every replica reads and writes"""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def add(self, key, timestamp, window):
+        self.store.setdefault(key, []).append(timestamp)
+
+    async def recent(self, key, since):
+        return [timestamp for timestamp in self.store.get(key, []) if timestamp >= since]
+
+    async def clear(self, key):
+        self.store.pop(key, None)
+
+
+@pytest.mark.asyncio
+async def test_login_throttle_shared_across_replicas_with_backoff(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    monkeypatch.setattr(settings, 'login_max_failures_per_username', 2)
+    store = {}
+    replica_a, replica_b = LoginThrottle(SharedStoreBackend(store)), LoginThrottle(SharedStoreBackend(store))
+
+    await replica_a.record_failure('victim', '10.0.0.1')
+    await replica_a.record_failure('victim', '10.0.0.2')
+    with pytest.raises(HTTPException) as exc_info:
+        await replica_b.check('Victim', '10.0.0.3')
+    assert exc_info.value.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert exc_info.value.headers['Retry-After'] == str(int(settings.login_backoff_base_seconds))
+
+    # Each failure past the limit doubles the wait
+    now += settings.login_backoff_base_seconds
+    await replica_b.check('victim', '10.0.0.3')
+    await replica_b.record_failure('victim', '10.0.0.3')
+    with pytest.raises(HTTPException) as exc_info:
+        await replica_a.check('victim', '10.0.0.4')
+    assert exc_info.value.headers['Retry-After'] == str(int(2 * settings.login_backoff_base_seconds))
+
+    # Failures slide out of the window
+    now += settings.login_throttle_window_seconds
+    await replica_a.check('victim', '10.0.0.4')
+
+
+def _request_from(host, forwarded_for=None):
+    headers = [(b'x-forwarded-for', forwarded_for.encode())] if forwarded_for else []
+    return Request({'type': 'http', 'client': (host, 50000), 'headers': headers})
+
+
+@pytest.mark.parametrize('field', ['login_max_failures_per_username', 'login_max_failures_per_ip'])
+def test_login_failure_limits_stay_within_the_kept_failures(field):
+    # The throttle keeps MAX_LOGIN_FAILURES_PER_KEY failures per key, a higher limit would never trigger
+    with pytest.raises(ValidationError, match=field):
+        Settings(**{field: MAX_LOGIN_FAILURES_PER_KEY + 1})
+
+
+def test_client_ip_read_from_trusted_proxies_only(monkeypatch):
+    # Without trusted proxies the header is ignored, anyone could forge it
+    assert request_client_ip(_request_from('10.0.0.5', '198.51.100.1')) == '10.0.0.5'
+
+    monkeypatch.setattr(settings, 'trusted_proxies', '10.0.0.0/8, 192.0.2.1')
+    assert request_client_ip(_request_from('203.0.113.7', '198.51.100.1')) == '203.0.113.7'
+    assert request_client_ip(_request_from('10.0.0.5', '198.51.100.1')) == '198.51.100.1'
+    # Entries left of the first untrusted hop were written by the client itself
+    assert request_client_ip(_request_from('192.0.2.1', '1.2.3.4, 198.51.100.1, 10.0.0.9')) == '198.51.100.1'
+    assert request_client_ip(_request_from('10.0.0.5')) == '10.0.0.5'
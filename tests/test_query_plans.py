@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from fastapi_boilerplate.core.cache import search_available_cache
+from fastapi_boilerplate.crud.users import LISTING_INDEXES, listing_cursor_key, user_crud
+from fastapi_boilerplate.schemas.pagination import SortOrder
+from fastapi_boilerplate.schemas.users import UserCreate, UserFilterPage, UserSortKey, UserUpdate
+from tests.plans import (
+    SORT_NODES,
+    IndexInfo,
+    capture_statements,
+    duplicate_indexes,
+    explain,
+    plan_indexes,
+    plan_nodes,
+    table_indexes,
+)
+
+SEED_USERS = 20000
+
+# Pages and lookups must stay a fraction of the cost of reading the whole table
+MAX_COST_RATIO = 0.25
+
+# One user per minute over the last two weeks, 10% admins, a quarter of them on one email domain
+SEED_USERS_SQL = """
+INSERT INTO users (id, username, email, first_name, last_name, password, is_admin, created_at)
+SELECT gen_random_uuid(), 'user_' || i,
+       'user_' || i || '@' || CASE WHEN i % 4 = 0 THEN 'example.com' ELSE 'example' || i % 50 || '.com' END,
+       'First ' || i, 'Last ' || i, 'not-a-hash', i % 10 = 0, now() - i * interval '1 minute'
+FROM generate_series(1, :users) i
+"""
+
+FILTER_VALUES = {'is_admin': True, 'email_domain': 'example.com'}
+
+
+async def _stream_all(session):
+    return [user async for user in user_crud.stream_users(session)]
+
+
+# The only statements allowed to read the whole users table, each with the reason it has to
+FULL_TABLE_READS = {
+    # Listings count filtered users up to a bound, and can count them all through the cached or estimated strategy
+    'get_users_count': (user_crud.get_users_count, 'an exact count of every user reads every row'),
+    'stream_users': (_stream_all, 'the export streams every user'),
+}
+
+
+@pytest_asyncio.fixture
+async def seeded_session(db_session):
+    await db_session.execute(text(SEED_USERS_SQL), {'users': SEED_USERS})
+    await db_session.commit()
+    await db_session.execute(text('ANALYZE users'))
+    await db_session.commit()
+    yield db_session
+
+
+async def _explain_captured(session, captured):
+    async with session.bind.connect() as conn:
+        return [(statement, await explain(conn, statement, parameters)) for statement, parameters in captured]
+
+
+async def _listing_plans(session, listing):
+    """
+    Plans of the offset and both cursor pages of a listing
+    """
+    # Seek from well inside the listing, where both directions have pages to read
+    (middle,) = await user_crud.get_users(session, skip=1000, limit=1, listing=listing)
+    key = listing_cursor_key(middle, listing.sort)
+    with capture_statements(session.bind) as captured:
+        await user_crud.get_users(session, skip=0, limit=51, listing=listing)
+        await user_crud.get_users(session, skip=100, limit=51, listing=listing)
+        await user_crud.get_users_by_cursor(session, key, direction='next', limit=51, listing=listing)
+        await user_crud.get_users_by_cursor(session, key, direction='prev', limit=51, listing=listing)
+        if listing.is_filtered:
+            # Counted like a page, off the listing's index up to a bound: its cost follows the bound, not the table
+            await user_crud.get_users_count_bounded(session, listing, 51)
+    return await _explain_captured(session, captured)
+
+
+def _listings():
+    """
+    Every indexed listing with the indexes that may serve it: its own, or the plain sort index when the filters
+    match so many rows that walking the sort order and skipping the others is cheaper
+    """
+    for (filters, sort), index in LISTING_INDEXES.items():
+        indexes = {index, LISTING_INDEXES[(frozenset(), sort)]}
+        values = {name: FILTER_VALUES[name] for name in filters}
+        for order in SortOrder:
+            yield indexes, UserFilterPage(**values, sort=sort, order=order)
+            if sort == UserSortKey.created_at:
+                created_after = datetime.now() - timedelta(days=10)
+                yield indexes, UserFilterPage(**values, sort=sort, order=order, created_after=created_after)
+
+
+def _problems(statement, plan, max_cost, indexes=None, paginated=False):
+    nodes = list(plan_nodes(plan))
+    problems = []
+    if any(node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == 'users' for node in nodes):
+        problems.append('scans the whole table')
+    if paginated and any(node['Node Type'] in SORT_NODES for node in nodes):
+        problems.append('sorts instead of reading in index order')
+    if indexes is not None and not indexes & plan_indexes(plan):
+        problems.append(f'uses none of {sorted(indexes)} (uses {sorted(plan_indexes(plan))})')
+    if plan['Total Cost'] > max_cost:
+        problems.append(f'costs {plan["Total Cost"]:.0f} > {max_cost:.0f}')
+    return [f'{problem}: {statement}' for problem in problems]
+
+
+@pytest_asyncio.fixture
+async def max_cost(seeded_session):
+    async with seeded_session.bind.connect() as conn:
+        full_scan = await explain(conn, 'SELECT * FROM users')
+    return full_scan['Total Cost'] * MAX_COST_RATIO
+
+
+@pytest.mark.asyncio
+async def test_lookups_and_writes_by_key_use_indexes(seeded_session, max_cost):
+    user = await user_crud.get_user_by_username(seeded_session, 'user_100')
+    other = await user_crud.get_user_by_username(seeded_session, 'user_200')
+    payload = {'first_name': 'New', 'last_name': 'User', 'password': 'secret123'}
+    single_user = UserCreate(username='single', email='single@example.com', **payload)
+    new_users = [
+        UserCreate(username='new_user', email='new_user@example.com', **payload),
+        # Conflicts with an existing user, described by a lookup on both unique indexes
+        UserCreate(username=user.username, email='other@example.com', **payload),
+    ]
+
+    # The pg_trgm check is cached once done
+    search_available_cache.clear()
+    with capture_statements(seeded_session.bind) as captured:
+        await user_crud.get_user_by_id(seeded_session, user.id)
+        await user_crud.get_user_by_username(seeded_session, user.username)
+        await user_crud.get_user_by_email(seeded_session, user.email)
+        await user_crud.update_user(seeded_session, user.id, UserUpdate(first_name='Renamed'))
+        await user_crud.delete_user(seeded_session, other.id)
+        await user_crud.create_user(seeded_session, single_user)
+        await user_crud.bulk_create_users(seeded_session, new_users)
+        await user_crud.get_users_count_estimate(seeded_session)
+        await user_crud.search_available(seeded_session)
+
+    plans = await _explain_captured(seeded_session, captured)
+    # Lookups, update, delete, single insert, bulk insert and its conflicts, estimate and the pg_trgm check
+    assert len(plans) == 10  # noqa: PLR2004
+    problems = [problem for statement, plan in plans for problem in _problems(statement, plan, max_cost)]
+    assert not problems, '\n'.join(problems)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name', FULL_TABLE_READS)
+async def test_full_table_reads_are_allowlisted(seeded_session, max_cost, name):
+    call, reason = FULL_TABLE_READS[name]
+    with capture_statements(seeded_session.bind) as captured:
+        await call(seeded_session)
+
+    # Keep the allowlist to the statements that still need it
+    plans = await _explain_captured(seeded_session, captured)
+    assert plans
+    for statement, plan in plans:
+        assert _problems(statement, plan, max_cost), f'{name} no longer reads the whole table ({reason})'
+
+
+@pytest.mark.asyncio
+async def test_listing_pages_read_their_index_without_sorting(seeded_session, max_cost):
+    problems = []
+    for indexes, listing in _listings():
+        for statement, plan in await _listing_plans(seeded_session, listing):
+            problems.extend(_problems(statement, plan, max_cost, indexes=indexes, paginated=True))
+    assert not problems, '\n'.join(problems)
+
+
+@pytest.mark.asyncio
+async def test_search_uses_trigram_index(seeded_session, max_cost):
+    if not await seeded_session.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")):
+        pytest.skip('pg_trgm is not available')
+
+    with capture_statements(seeded_session.bind) as captured:
+        (user, rank), *_ = await user_crud.search_users(seeded_session, 'user_1234', limit=21)
+        await user_crud.search_users(seeded_session, 'user_1234', limit=21, after=(rank, user.id))
+
+    # Ranking sorts the matches, which the index keeps to a handful of rows
+    for statement, plan in await _explain_captured(seeded_session, captured):
+        problems = _problems(statement, plan, max_cost, indexes={'ix_users_search_trgm'})
+        assert not problems, '\n'.join(problems)
+
+
+@pytest.mark.asyncio
+async def test_every_users_index_serves_a_statement(seeded_session):
+    used = set()
+    user = await user_crud.get_user_by_username(seeded_session, 'user_100')
+    with capture_statements(seeded_session.bind) as captured:
+        await user_crud.get_user_by_id(seeded_session, user.id)
+        await user_crud.get_user_by_email(seeded_session, user.email)
+        if await seeded_session.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")):
+            await user_crud.search_users(seeded_session, 'user_1234', limit=21)
+    for _, plan in await _explain_captured(seeded_session, captured):
+        used |= plan_indexes(plan)
+    for _, listing in _listings():
+        for _, plan in await _listing_plans(seeded_session, listing):
+            used |= plan_indexes(plan)
+
+    async with seeded_session.bind.connect() as conn:
+        indexes = await table_indexes(conn, 'users')
+    assert duplicate_indexes(indexes) == []
+    assert sorted(index.name for index in indexes if index.name not in used) == []
+
+
+def test_duplicate_indexes():
+    indexes = [
+        IndexInfo('users_pkey', unique=True, method='btree', columns=('id',)),
+        IndexInfo('ix_users_id', unique=False, method='btree', columns=('id',)),
+        IndexInfo('ix_users_is_admin', unique=False, method='btree', columns=('is_admin',)),
+        IndexInfo('ix_users_is_admin_username', unique=False, method='btree', columns=('is_admin', 'username')),
+        IndexInfo('ix_users_username_hash', unique=False, method='hash', columns=('username',)),
+        IndexInfo('ix_users_username', unique=True, method='btree', columns=('username',)),
+        IndexInfo('ix_users_active', unique=False, method='btree', columns=('id',), predicate='NOT is_admin'),
+    ]
+    assert duplicate_indexes(indexes) == [
+        ('ix_users_id', 'users_pkey'),
+        ('ix_users_is_admin', 'ix_users_is_admin_username'),
+    ]
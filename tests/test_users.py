@@ -1,6 +1,20 @@
+import csv
+import io
+import json
 from http import HTTPStatus
 
 import pytest
+import pytest_asyncio
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from fastapi_boilerplate.core.cache import principal_cache
+from fastapi_boilerplate.core.query_stats import QueryBudgetExceeded, track_queries
+from fastapi_boilerplate.core.settings import MAX_BULK_INSERT_BATCH_SIZE, Settings, settings
+from fastapi_boilerplate.crud import users as users_module
+from fastapi_boilerplate.crud.users import LISTING_INDEXES, user_crud
+from fastapi_boilerplate.models.users import User
+from fastapi_boilerplate.schemas.users import UserCreate, UserUpdate
 
 
 @pytest.fixture
@@ -65,6 +79,7 @@ def test_create_user_duplicate_username(client, admin_token, user_payload):
     payload_duplicated['email'] = 'other_email@example.com'
     r = client.post('/api/v1/users/', json=payload_duplicated)
     assert r.status_code == HTTPStatus.CONFLICT
+    assert r.json()['detail'] == 'username already exists'
 
 
 def test_create_user_duplicate_email(client, admin_token, user_payload):
@@ -75,6 +90,13 @@ def test_create_user_duplicate_email(client, admin_token, user_payload):
     payload_duplicated['username'] = 'other_username'
     r = client.post('/api/v1/users/', json=payload_duplicated)
     assert r.status_code == HTTPStatus.CONFLICT
+    assert r.json()['detail'] == 'email already exists'
+
+
+def test_create_admin_twice(client, admin_user):
+    r = client.post('/api/v1/users/create_admin', params={'password': 'another-password'})
+    assert r.status_code == HTTPStatus.CONFLICT
+    assert r.json()['detail'] == 'Admin user already exists'
 
 
 def test_list_users(client, admin_token, created_user):
@@ -85,6 +107,165 @@ def test_list_users(client, admin_token, created_user):
     assert any(u['id'] == created_user['id'] for u in users['items'])
 
 
+def test_list_users_cursor_pagination(client, admin_token, created_user, created_user_2, monkeypatch):
+    monkeypatch.setattr(settings, 'debug', True)
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/?limit=1')
+    first_page = r.json()
+    assert [u['username'] for u in first_page['items']] == ['admin']
+    assert first_page['prev_cursor'] is None
+
+    r = client.get('/api/v1/users/', params={'limit': 1, 'cursor': first_page['next_cursor']})
+    assert r.status_code == HTTPStatus.OK
+    second_page = r.json()
+    assert [u['username'] for u in second_page['items']] == ['test_user']
+    assert second_page['page'] is None
+    assert second_page['has_next'] is True
+    # A keyset page is a single seek, not counted unless asked to
+    assert second_page['total_count'] is None
+    assert r.headers['x-db-query-count'] == '1'
+
+    r = client.get('/api/v1/users/', params={'limit': 1, 'cursor': second_page['next_cursor']})
+    last_page = r.json()
+    assert [u['username'] for u in last_page['items']] == ['test_user_2']
+    assert last_page['has_next'] is False
+    assert last_page['next_cursor'] is None
+
+    r = client.get('/api/v1/users/', params={'limit': 2, 'cursor': last_page['prev_cursor']})
+    assert [u['username'] for u in r.json()['items']] == ['admin', 'test_user']
+    assert r.json()['has_previous'] is False
+
+
+def test_list_users_sorted_by_created_at_desc(client, admin_token, created_user, created_user_2):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    params = {'limit': 1, 'sort': 'created_at', 'order': 'desc'}
+    r = client.get('/api/v1/users/', params=params)
+    assert r.status_code == HTTPStatus.OK
+    first_page = r.json()
+    assert [u['username'] for u in first_page['items']] == ['test_user_2']
+
+    r = client.get('/api/v1/users/', params={**params, 'cursor': first_page['next_cursor']})
+    assert [u['username'] for u in r.json()['items']] == ['test_user']
+    r = client.get('/api/v1/users/', params={**params, 'cursor': r.json()['next_cursor']})
+    last_page = r.json()
+    assert [u['username'] for u in last_page['items']] == ['admin']
+    assert last_page['has_next'] is False
+
+    r = client.get('/api/v1/users/', params={**params, 'limit': 2, 'cursor': last_page['prev_cursor']})
+    assert [u['username'] for u in r.json()['items']] == ['test_user_2', 'test_user']
+
+
+def test_list_users_filters(client, admin_token, created_user, created_user_2, monkeypatch):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/', params={'is_admin': False, 'limit': 1})
+    page = r.json()
+    assert [u['username'] for u in page['items']] == ['test_user']
+    assert page['total_count'] == 2  # noqa: PLR2004
+
+    # Past the bound a filtered listing is left uncounted, has_next still tells whether it continues
+    monkeypatch.setattr(settings, 'pagination_filtered_count_limit', 1)
+    r = client.get('/api/v1/users/', params={'is_admin': False, 'limit': 1})
+    assert r.json()['total_count'] is None
+    assert r.json()['has_next'] is True
+    monkeypatch.setattr(settings, 'pagination_filtered_count_limit', 2)
+    r = client.get('/api/v1/users/', params={'is_admin': False, 'limit': 1})
+    assert r.json()['total_count'] == 2  # noqa: PLR2004
+
+    r = client.get('/api/v1/users/', params={'is_admin': False, 'limit': 1, 'cursor': page['next_cursor']})
+    assert [u['username'] for u in r.json()['items']] == ['test_user_2']
+
+    r = client.get('/api/v1/users/', params={'email_domain': 'ADMIN.com', 'sort': 'created_at'})
+    assert [u['username'] for u in r.json()['items']] == ['admin']
+
+    created_at = created_user_2['created_at']
+    r = client.get('/api/v1/users/', params={'created_before': created_at, 'sort': 'created_at', 'order': 'desc'})
+    assert [u['username'] for u in r.json()['items']] == ['test_user', 'admin']
+
+    # Estimated and cached counts cannot account for the filters
+    r = client.get('/api/v1/users/', params={'is_admin': True, 'count': 'estimated'})
+    assert r.json()['total_count'] is None
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        {'is_admin': True, 'sort': 'email'},
+        {'created_after': '2024-01-01T00:00:00', 'sort': 'username'},
+        {'is_admin': True, 'email_domain': 'example.com'},
+    ],
+)
+def test_list_users_rejects_unindexed_listings(client, admin_token, params):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/', params=params)
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+    assert 'not supported' in r.json()['detail']
+
+
+def test_listing_indexes_exist():
+    indexes = {index.name for index in User.__table__.indexes}
+    assert set(LISTING_INDEXES.values()) <= indexes
+
+
+@pytest.mark.parametrize('strategy', ['exact', 'cached'])
+def test_list_users_count_strategies(client, admin_token, created_user, strategy):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/', params={'limit': 1, 'count': strategy})
+    assert r.status_code == HTTPStatus.OK
+    page = r.json()
+    assert page['total_count'] == 2  # noqa: PLR2004
+    assert page['has_next'] is True
+    assert page['approximate_count'] is (strategy == 'cached')
+
+
+def test_list_users_estimated_count_of_unanalyzed_table(client, admin_token, created_user):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    # A cold principal cache costs the request a query of its own
+    principal_cache.clear()
+    r = client.get('/api/v1/users/', params={'limit': 1, 'count': 'estimated'})
+    assert r.status_code == HTTPStatus.OK
+    page = r.json()
+    assert page['total_count'] is None
+    assert page['approximate_count'] is False
+    assert page['has_next'] is True
+
+
+@pytest.mark.asyncio
+async def test_crud_users_count_estimate(db_session, user_payload):
+    assert await user_crud.get_users_count_estimate(db_session) is None
+    await user_crud.create_user(db_session, UserCreate(**user_payload))
+    await db_session.execute(text('ANALYZE users'))
+    assert await user_crud.get_users_count_estimate(db_session) == 1
+
+
+def test_list_users_without_count(client, admin_token, created_user):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/', params={'limit': 1, 'count': 'none'})
+    page = r.json()
+    assert page['total_count'] is None
+    assert page['total_pages'] is None
+    assert page['has_next'] is True
+
+    r = client.get('/api/v1/users/', params={'skip': 1, 'limit': 1, 'count': 'none'})
+    assert r.json()['has_next'] is False
+
+
+def test_list_users_fast_json_matches_default(client, admin_token, created_user, monkeypatch):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    expected = client.get('/api/v1/users/', params={'limit': 1}).json()
+
+    monkeypatch.setattr(settings, 'fast_json_responses', True)
+    r = client.get('/api/v1/users/', params={'limit': 1})
+    assert r.status_code == HTTPStatus.OK
+    assert r.json() == expected
+    assert 'password' not in r.json()['items'][0]
+
+
+def test_list_users_invalid_cursor(client, admin_token):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/', params={'cursor': 'not-a-cursor'})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+
 def test_get_user_by_id(client, admin_token, created_user):
     client.headers.update({'Authorization': f'Bearer {admin_token}'})
     r = client.get(f'/api/v1/users/{created_user["id"]}')
@@ -93,6 +274,37 @@ def test_get_user_by_id(client, admin_token, created_user):
     assert user_data['id'] == created_user['id']
 
 
+def test_get_user_conditional(client, admin_token, created_user):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get(f'/api/v1/users/{created_user["id"]}')
+    etag = r.headers['etag']
+
+    r = client.get(f'/api/v1/users/{created_user["id"]}', headers={'If-None-Match': etag})
+    assert r.status_code == HTTPStatus.NOT_MODIFIED
+    assert r.headers['etag'] == etag
+    assert not r.content
+
+    r = client.patch(f'/api/v1/users/{created_user["id"]}', json={'first_name': 'Changed'})
+    assert r.headers['etag'] != etag
+
+    r = client.get(f'/api/v1/users/{created_user["id"]}', headers={'If-None-Match': etag})
+    assert r.status_code == HTTPStatus.OK
+    assert r.json()['first_name'] == 'Changed'
+
+
+def test_list_users_conditional(client, admin_token, created_user, user_payload_2):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    etag = client.get('/api/v1/users/').headers['etag']
+
+    r = client.get('/api/v1/users/', headers={'If-None-Match': f'W/{etag}, "other"'})
+    assert r.status_code == HTTPStatus.NOT_MODIFIED
+
+    client.post('/api/v1/users/', json=user_payload_2)
+    r = client.get('/api/v1/users/', headers={'If-None-Match': etag})
+    assert r.status_code == HTTPStatus.OK
+    assert r.headers['etag'] != etag
+
+
 def test_update_user_as_admin(client, admin_token, created_user):
     client.headers.update({'Authorization': f'Bearer {admin_token}'})
     r = client.patch(f'/api/v1/users/{created_user["id"]}', json={'first_name': 'NewName'})
@@ -144,3 +356,194 @@ def test_authentication_required(client, user_payload):
     assert r.status_code == HTTPStatus.UNAUTHORIZED
     r = client.delete('/api/v1/users/00000000-0000-0000-0000-000000000000')
     assert r.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_crud_create_and_authenticate_user(db_session, user_payload):
+    user = await user_crud.create_user(db_session, UserCreate(**user_payload))
+    assert await user_crud.get_users_count(db_session) == 1
+
+    authenticated = await user_crud.authenticate_user(db_session, user_payload['username'], user_payload['password'])
+    assert authenticated.id == user.id
+    assert await user_crud.authenticate_user(db_session, user_payload['username'], 'wrongpassword') is None
+
+
+@pytest.mark.asyncio
+async def test_crud_update_and_delete_protect_admin(db_session, user_payload):
+    admin = await user_crud.create_admin(db_session, 'admin-secret')
+    user = await user_crud.create_user(db_session, UserCreate(**user_payload))
+    principal_cache.set(user.username, user)
+
+    updated = await user_crud.update_user(db_session, user.id, UserUpdate(username='renamed'))
+    assert updated.username == 'renamed'
+    assert principal_cache.get(user_payload['username']) is None
+
+    with pytest.raises(ValueError, match='admin privileges'):
+        await user_crud.update_user(db_session, admin.id, UserUpdate(is_admin=False))
+    with pytest.raises(ValueError, match='Cannot delete'):
+        await user_crud.delete_user(db_session, admin.id)
+
+    assert await user_crud.delete_user(db_session, user.id) is True
+    assert await user_crud.delete_user(db_session, user.id) is False
+    assert await user_crud.update_user(db_session, user.id, UserUpdate(first_name='x')) is None
+
+
+def test_bulk_create_users(client, admin_token, created_user, user_payload, user_payload_2):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    payload = [
+        user_payload_2,
+        {**user_payload, 'email': 'other_email@example.com'},
+        {**user_payload_2, 'username': 'other_username'},
+        {**user_payload, 'username': 'test_user_3', 'email': 'test_user_3@example.com'},
+    ]
+    r = client.post('/api/v1/users/bulk', json=payload)
+    assert r.status_code == HTTPStatus.CREATED
+    result = r.json()
+    assert result['created'] == 2  # noqa: PLR2004
+    assert [(c['index'], c['detail']) for c in result['conflicts']] == [
+        (1, 'username already exists'),
+        (2, 'email already exists'),
+    ]
+
+    r = client.post(
+        '/api/v1/auth/login',
+        data={'username': 'test_user_3', 'password': user_payload['password']},
+        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+    )
+    assert r.status_code == HTTPStatus.OK
+
+
+def test_bulk_create_users_in_batches(client, admin_token, user_payload, monkeypatch):
+    monkeypatch.setattr(settings, 'bulk_insert_batch_size', 2)
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    payload = [{**user_payload, 'username': f'user_{i}', 'email': f'user_{i}@example.com'} for i in range(5)]
+    r = client.post('/api/v1/users/bulk', json=payload)
+    assert r.status_code == HTTPStatus.CREATED
+    assert r.json() == {'created': 5, 'conflicts': []}
+
+
+def test_bulk_insert_batch_size_stays_under_parameter_limit():
+    with pytest.raises(ValidationError):
+        Settings(bulk_insert_batch_size=MAX_BULK_INSERT_BATCH_SIZE + 1)
+
+
+@pytest.mark.asyncio
+async def test_crud_bulk_create_users_full_batch(db_session, user_payload, monkeypatch):
+    async def hash_password(password):
+        return 'not-a-hash'
+
+    # Hashing thousands of passwords is not what is under test
+    monkeypatch.setattr(users_module, 'get_password_hash_async', hash_password)
+    users = [
+        UserCreate(**{**user_payload, 'username': f'user_{i}', 'email': f'user_{i}@example.com'})
+        for i in range(MAX_BULK_INSERT_BATCH_SIZE)
+    ]
+    result = await user_crud.bulk_create_users(db_session, users, batch_size=MAX_BULK_INSERT_BATCH_SIZE)
+    assert result.created == MAX_BULK_INSERT_BATCH_SIZE
+
+
+def test_export_users_ndjson(client, admin_token, created_user):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/export')
+    assert r.status_code == HTTPStatus.OK
+    assert r.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row['username'] for row in rows] == ['admin', 'test_user']
+    assert 'password' not in rows[1]
+    assert rows[1]['id'] == created_user['id']
+
+
+def test_export_users_csv(client, admin_token, created_user):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/export', params={'format': 'csv'})
+    assert r.status_code == HTTPStatus.OK
+    assert r.headers['content-type'].startswith('text/csv')
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row['username'] for row in rows] == ['admin', 'test_user']
+    assert rows[1]['id'] == created_user['id']
+
+
+def test_query_stats_headers_in_debug_mode(client, admin_token, created_user, monkeypatch):
+    monkeypatch.setattr(settings, 'debug', True)
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get(f'/api/v1/users/{created_user["id"]}')
+    assert r.status_code == HTTPStatus.OK
+    assert int(r.headers['x-db-query-count']) >= 1
+    assert r.headers['server-timing'].startswith('db;dur=')
+
+
+@pytest.mark.asyncio
+async def test_query_budget_exceeded(db_session, monkeypatch):
+    monkeypatch.setattr(settings, 'query_budget_strict', True)
+    with track_queries() as stats:
+        stats.budget = 1
+        await user_crud.get_users_count(db_session)
+        with pytest.raises(QueryBudgetExceeded):
+            await user_crud.get_users_count(db_session)
+
+
+@pytest_asyncio.fixture
+async def pg_trgm_installed(db_session):
+    return bool(await db_session.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")))
+
+
+@pytest.mark.asyncio
+async def test_crud_search_users_ranks_and_continues(db_session, user_payload, pg_trgm_installed):
+    if not pg_trgm_installed:
+        pytest.skip('pg_trgm is not available')
+
+    for username, first_name in [('maria_silva', 'Maria'), ('mario_souza', 'Mario'), ('joao_pereira', 'Joao')]:
+        payload = {**user_payload, 'username': username, 'email': f'{username}@example.com', 'first_name': first_name}
+        await user_crud.create_user(db_session, UserCreate(**payload))
+
+    rows = await user_crud.search_users(db_session, 'maria', limit=1)
+    assert [user.username for user, _ in rows] == ['maria_silva']
+
+    # A typo still matches through trigram similarity, and the rank and id of the last row continue the search
+    user, rank = (await user_crud.search_users(db_session, 'silvaa', limit=1))[0]
+    assert user.username == 'maria_silva'
+    rest = await user_crud.search_users(db_session, 'silvaa', limit=10, after=(rank, user.id))
+    assert user.username not in [other.username for other, _ in rest]
+    assert all(other_rank <= rank for _, other_rank in rest)
+
+    # LIKE wildcards in the query are matched literally
+    assert await user_crud.search_users(db_session, '%_%', limit=10) == []
+
+
+def test_search_users_validates_query_and_cursor(client, admin_token):
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/search', params={'q': 'ab'})
+    assert r.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    r = client.get('/api/v1/users/search', params={'q': 'admin', 'limit': settings.search_max_results + 1})
+    assert r.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    r = client.get('/api/v1/users/search', params={'q': 'admin', 'cursor': 'garbage'})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_search_users(client, admin_token, created_user, created_user_2, pg_trgm_installed):
+    if not pg_trgm_installed:
+        pytest.skip('pg_trgm is not available')
+
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/search', params={'q': 'test_user_2', 'limit': 1})
+    assert r.status_code == HTTPStatus.OK
+    page = r.json()
+    assert [user['username'] for user in page['items']] == ['test_user_2']
+    assert page['has_next'] is True
+
+    r = client.get('/api/v1/users/search', params={'q': 'test_user_2', 'cursor': page['next_cursor']})
+    assert r.status_code == HTTPStatus.OK
+    page = r.json()
+    assert 'test_user_2' not in [user['username'] for user in page['items']]
+    assert page['has_previous'] is True
+
+
+def test_search_users_unavailable_without_pg_trgm(client, admin_token, monkeypatch):
+    async def search_available(db):
+        return False
+
+    monkeypatch.setattr(user_crud, 'search_available', search_available)
+    client.headers.update({'Authorization': f'Bearer {admin_token}'})
+    r = client.get('/api/v1/users/search', params={'q': 'admin'})
+    assert r.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert 'pg_trgm' in r.json()['detail']